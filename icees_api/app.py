@@ -1,28 +1,29 @@
 """ICEES API entrypoint."""
 from functools import wraps
 import inspect
-import json
 import logging
 from logging.handlers import TimedRotatingFileHandler
 import os
 from pathlib import Path
 from time import strftime
-from typing import Any
+from typing import Any, Iterator
 
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.encoders import jsonable_encoder
 from fastapi.openapi.utils import get_openapi
 from fastapi.responses import PlainTextResponse
 from jsonschema import ValidationError
-from starlette.responses import Response, JSONResponse
+from starlette.responses import Response, JSONResponse, StreamingResponse
 from structlog import wrap_logger
 from structlog.processors import JSONRenderer
 import yaml
 
-from .features import format_
+from .db import DBConnection
+from .dependencies import ConnectionWithTables, reflect_tables
+from .features import cache, columnar, dataset_version, format_, json_, snapshot, sql, static, warmup
 from .features.knowledgegraph import TOOL_VERSION
 
-from .handlers import ROUTER
+from .handlers import ROUTER, TABLES
 from .trapi import TRAPI
 
 CONFIG_PATH = os.getenv('CONFIG_PATH', './config')
@@ -42,14 +43,8 @@ class NaNResponse(JSONResponse):
     media_type = "application/json"
 
     def render(self, content: Any) -> bytes:
-        """Convert to str."""
-        return json.dumps(
-            content,
-            ensure_ascii=False,
-            allow_nan=True,
-            indent=None,
-            separators=(",", ":"),
-        ).replace(":NaN,", ":null,").encode("utf-8")
+        """Convert to bytes."""
+        return json_.dumps(content)
 
 
 openapi_args = dict(
@@ -94,6 +89,74 @@ LOGGER.addHandler(HANDLER)
 LOGGER = wrap_logger(LOGGER, processors=[JSONRenderer()])
 
 
+@APP.on_event("startup")
+def reflect_schema():
+    """Reflect the database schema once, for all requests.
+
+    Pending cohort table migrations are applied here too.
+    """
+    with DBConnection() as conn:
+        conn = ConnectionWithTables(conn, reflect_tables(conn))
+        if "cohort" in conn.tables:
+            sql.ensure_cohort_digest(conn)
+
+
+@APP.on_event("startup")
+def build_static_responses():
+    """Build static responses."""
+    static.registry.build_all()
+
+
+@APP.on_event("startup")
+def configure_cache():
+    """Configure the cache."""
+    cache.configure()
+
+
+@APP.on_event("startup")
+def read_dataset_version():
+    """Version the cache by the data in the database, if not fixed.
+
+    The version is then watched in the background.
+    """
+    if not dataset_version.tracking():
+        return
+    with DBConnection() as conn:
+        dataset_version.update(ConnectionWithTables(conn))
+    dataset_version.start()
+
+
+@APP.on_event("startup")
+def load_columnar_tables():
+    """Load tables into the in-memory columnar engine, if enabled.
+
+    A columnar snapshot, if configured, is preferred over the database,
+    and its version versions the cache.
+    """
+    if snapshot.SNAPSHOT_PATH is not None:
+        for columnar_table in snapshot.read(snapshot.SNAPSHOT_PATH).values():
+            columnar.register(columnar_table)
+        cache.dataset_version = dataset_version.current()
+    elif columnar.COLUMNAR:
+        with DBConnection() as conn:
+            columnar.load(conn, TABLES)
+
+
+@APP.on_event("shutdown")
+def stop_watching_dataset_version():
+    """Stop watching the database version."""
+    dataset_version.stop()
+
+
+@APP.on_event("startup")
+def warm_cache():
+    """Warm the caches, if enabled, before accepting requests."""
+    if not warmup.WARMUP:
+        return
+    with DBConnection() as conn:
+        warmup.run(ConnectionWithTables(conn))
+
+
 @APP.get("/tos", response_class=PlainTextResponse)
 def terms_of_service():
     """Get terms of service."""
@@ -104,6 +167,7 @@ def terms_of_service():
 async def fix_tabular_outputs(request: Request, call_next):
     """Fix tabular outputs."""
     response = await call_next(request)
+    response.headers["X-ICEES-Dataset-Version"] = str(cache.dataset_version)
 
     timestamp = strftime('%Y-%b-%d %H:%M:%S')
     LOGGER.info(
@@ -131,6 +195,15 @@ def jsonable_safe(obj):
         return obj
 
 
+def log_stream_errors(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Log errors while streaming, ending the stream with the error."""
+    try:
+        yield from lines
+    except Exception as err:
+        LOGGER.exception(err)
+        yield json_.dumps({"return value": str(err)}) + b"\n"
+
+
 def prepare_output(func):
     """Prepare output."""
     @wraps(func)
@@ -147,6 +220,14 @@ def prepare_output(func):
         try:
             return_value = func(*args, **kwargs)
 
+            # generated values are only streamed as NDJSON, not as tabular data
+            if (
+                    request.headers["accept"] == "text/tabular"
+                    and isinstance(return_value, dict)
+                    and isinstance(return_value.get("return value"), Iterator)
+            ):
+                return_value = {**return_value, "return value": list(return_value["return value"])}
+
         except ValidationError as err:
             LOGGER.exception(err)
             return_value = {"return value": err.message}
@@ -156,6 +237,22 @@ def prepare_output(func):
             LOGGER.exception(err)
             return_value = {"return value": str(err)}
 
+        # serve static responses pre-serialized, unless tabular data is requested
+        if isinstance(return_value, static.StaticResponse):
+            if request.headers["accept"] != "text/tabular":
+                return static.respond(return_value.with_terms(TERMS_AND_CONDITIONS), request)
+            return_value = return_value.value
+
+        # stream generated values as NDJSON
+        if isinstance(return_value, dict) and isinstance(return_value.get("return value"), Iterator):
+            return StreamingResponse(
+                log_stream_errors(format_.format_ndjson(
+                    TERMS_AND_CONDITIONS,
+                    return_value["return value"],
+                )),
+                media_type=format_.NDJSON,
+            )
+
         # return tabular data, if requested
         if request.headers["accept"] == "text/tabular":
             content = format_.format_tabular(
@@ -1,26 +1,57 @@
 """FastAPI dependencies."""
+from typing import Dict, Mapping
+
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.automap import automap_base
 
 from .db import DBConnection, Connection
 
+# reflected tables, per engine, shared by every connection of the process
+schemas: Dict[Engine, Mapping[str, Table]] = {}
+
+
+def reflect_tables(conn: Connection, refresh: bool = False) -> Mapping[str, Table]:
+    """Get tables, reflecting the schema only once per process and engine."""
+    if refresh or conn.engine not in schemas:
+        Base = automap_base()
+        Base.prepare(conn, reflect=True)  # reflect the tables
+        schemas[conn.engine] = Base.metadata.tables
+    return schemas[conn.engine]
+
 
 class ConnectionWithTables():
     """Connection with tables."""
 
-    def __init__(self, connection, tables):
-        """Initialize."""
+    def __init__(self, connection, tables=None):
+        """Initialize.
+
+        If tables are not given, the process-wide schema cache is used.
+        """
         self.connection: Connection = connection
+        if tables is None:
+            tables = reflect_tables(connection)
         self.tables = tables
 
+    @property
+    def engine(self) -> Engine:
+        """Get engine."""
+        return self.connection.engine
+
+    def begin(self):
+        """Begin transaction."""
+        return self.connection.begin()
+
     def execute(self, *args, **kwargs):
         """Execute query."""
         return self.connection.execute(*args, **kwargs)
 
+    def refresh_tables(self):
+        """Re-reflect tables, e.g. after DDL."""
+        self.tables = reflect_tables(self.connection, refresh=True)
+
 
 async def get_db() -> ConnectionWithTables:
     """Get database connection."""
     with DBConnection() as conn:
-        Base = automap_base()
-        Base.prepare(conn.engine, reflect=True)  # reflect the tables
-        tables = Base.metadata.tables
-        yield ConnectionWithTables(conn, tables)
+        yield ConnectionWithTables(conn)
@@ -0,0 +1,227 @@
+"""Persistent cache of complete association results.
+
+Feature matrices, with their chi-squared statistics and p-values, are stored
+in the association_cache table of the ICEES database, keyed by a digest of
+the table, the canonical cohort definition, the cohort year, both features
+and the dataset version. Unlike redis, the cache survives restarts.
+
+Entries are evicted by access time once the table grows beyond
+ICEES_ASSOCIATION_CACHE_ROWS rows. Purge the cache with
+    python -m icees_api.features.association_cache --purge
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from hashlib import md5
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import column, func, table
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import select
+
+from ..db import DBConnection
+from ..dependencies import ConnectionWithTables
+from . import cache
+from .canonical import canonical_json
+
+logger = logging.getLogger(__name__)
+
+ASSOCIATION_CACHE = os.environ.get("ICEES_ASSOCIATION_CACHE", "false").lower() in ("1", "true", "yes")
+MAX_ROWS = int(os.environ.get("ICEES_ASSOCIATION_CACHE_ROWS", "100000"))
+# check the size cap after this many insertions, per process
+EVICT_EVERY = 100
+# digests per lookup query, within SQLite's limit of bound parameters
+LOOKUP_CHUNK_SIZE = 500
+
+association_cache = table(
+    "association_cache",
+    column("digest"),
+    column("association"),
+    column("table"),
+    column("cohort_features"),
+    column("cohort_year"),
+    column("feature_a"),
+    column("feature_b"),
+    column("dataset_version"),
+    column("access_time"),
+)
+insertions = 0
+
+
+def now() -> datetime:
+    """Get current (naive) UTC time."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def create_table(conn):
+    """Create association cache table, if necessary."""
+    if "association_cache" in conn.tables:
+        return
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS association_cache ("
+        "digest varchar(32) PRIMARY KEY, "
+        "association text, "
+        "\"table\" varchar(255), "
+        "cohort_features text, "
+        "cohort_year int, "
+        "feature_a text, "
+        "feature_b text, "
+        "dataset_version varchar(255), "
+        "access_time timestamp"
+        ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS association_cache_access_time "
+        "ON association_cache (access_time)"
+    )
+    conn.refresh_tables()
+
+
+def cohort_features_json(cohort_features) -> str:
+    """Get canonical JSON of cohort features; like the matrix, ignore years."""
+    return canonical_json(None, [
+        {key: value for key, value in feature.items() if key != "year"}
+        for feature in cohort_features
+    ])
+
+
+def digest(table_name, cohort_features, cohort_year, feature_a, feature_b) -> str:
+    """Get digest of association."""
+    c = md5()
+    for arg in (
+        json.dumps(table_name),
+        cohort_features_json(cohort_features),
+        json.dumps(cohort_year),
+        json.dumps(feature_a, sort_keys=True),
+        json.dumps(feature_b, sort_keys=True),
+        json.dumps(cache.dataset_version),
+    ):
+        c.update(arg.encode("utf-8"))
+    return c.hexdigest()
+
+
+def lookup_many(conn, digests: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get cached associations by digest, and update their access time.
+
+    Digests are looked up LOOKUP_CHUNK_SIZE at a time, and the access times
+    of the hits of each chunk are updated at once.
+    """
+    if "association_cache" not in conn.tables:
+        return {}
+    associations = {}
+    for start in range(0, len(digests), LOOKUP_CHUNK_SIZE):
+        chunk = digests[start:start + LOOKUP_CHUNK_SIZE]
+        hits = {
+            digest_: json.loads(association)
+            for digest_, association in conn.execute(
+                select([association_cache.c.digest, association_cache.c.association])
+                .where(association_cache.c.digest.in_(chunk))
+            )
+        }
+        if hits:
+            conn.execute(
+                association_cache.update()
+                .where(association_cache.c.digest.in_(list(hits)))
+                .values(access_time=now())
+            )
+        associations.update(hits)
+    return associations
+
+
+def lookup(conn, digest_: str) -> Optional[Dict[str, Any]]:
+    """Get cached association, if any, and update its access time."""
+    return lookup_many(conn, [digest_]).get(digest_)
+
+
+def store(
+        conn,
+        digest_: str,
+        table_name,
+        cohort_features,
+        cohort_year,
+        feature_a,
+        feature_b,
+        association: Dict[str, Any],
+):
+    """Cache association."""
+    global insertions
+    create_table(conn)
+    try:
+        conn.execute(association_cache.insert().values(
+            digest=digest_,
+            association=json.dumps(association),
+            table=table_name,
+            cohort_features=cohort_features_json(cohort_features),
+            cohort_year=cohort_year,
+            feature_a=json.dumps(feature_a, sort_keys=True),
+            feature_b=json.dumps(feature_b, sort_keys=True),
+            dataset_version=cache.dataset_version,
+            access_time=now(),
+        ))
+    except IntegrityError:
+        # stored concurrently
+        return
+    insertions += 1
+    if insertions % EVICT_EVERY == 0:
+        evict(conn)
+
+
+def evict(conn, max_rows: int = None):
+    """Delete least-recently-accessed associations beyond max_rows."""
+    if max_rows is None:
+        max_rows = MAX_ROWS
+    n_rows = conn.execute(
+        select([func.count()]).select_from(association_cache)
+    ).scalar()
+    if n_rows <= max_rows:
+        return 0
+    cutoff = conn.execute(
+        select([association_cache.c.access_time])
+        .order_by(association_cache.c.access_time.desc())
+        .offset(max_rows)
+        .limit(1)
+    ).scalar()
+    deleted = conn.execute(
+        association_cache.delete()
+        .where(association_cache.c.access_time <= cutoff)
+    ).rowcount
+    logger.info(f"evicted {deleted} cached associations")
+    return deleted
+
+
+def purge(conn, older_than: timedelta = None):
+    """Delete cached associations, optionally only those not accessed recently."""
+    query = association_cache.delete()
+    if older_than is not None:
+        query = query.where(association_cache.c.access_time < now() - older_than)
+    return conn.execute(query).rowcount
+
+
+def main():
+    """Purge or evict cached associations."""
+    parser = argparse.ArgumentParser(description="Manage association cache.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--purge", action="store_true")
+    action.add_argument("--evict", action="store_true")
+    parser.add_argument("--older-than-days", type=float, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with DBConnection() as conn:
+        conn = ConnectionWithTables(conn)
+        if "association_cache" not in conn.tables:
+            logger.info("no association cache")
+            return
+        if args.purge:
+            older_than = None
+            if args.older_than_days is not None:
+                older_than = timedelta(days=args.older_than_days)
+            logger.info(f"purged {purge(conn, older_than)} cached associations")
+        else:
+            evict(conn)
+
+
+if __name__ == "__main__":
+    main()
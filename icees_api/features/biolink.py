@@ -0,0 +1,159 @@
+"""Biolink hierarchy index.
+
+Query graphs are normalized by expanding each category and predicate into
+its descendants. The index holds these closures, already in the forms used
+by normalize_qgraph, keyed by category (PascalCase) and predicate
+(snake_case) CURIEs:
+
+    {"categories": {<curie>: [<descendant>, ...]}, "predicates": {...}}
+
+It is compiled from the Biolink model toolkit (BMT) with
+    python -m icees_api.features.biolink
+to ICEES_BIOLINK_INDEX, and must be recompiled when BMT is upgraded. Terms
+missing from the index, or a missing index, fall back to BMT, which is only
+loaded if needed. As such terms come from requests, the index is not
+extended with them; the last FALLBACK_CACHE_SIZE results are memoized.
+"""
+import argparse
+from functools import lru_cache
+import json
+import logging
+import os
+import re
+from threading import Lock
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.environ.get(
+    "ICEES_BIOLINK_INDEX",
+    os.path.join(os.path.dirname(__file__), "biolink_index.json"),
+)
+FALLBACK_CACHE_SIZE = 1024
+
+index: Optional[Dict[str, Dict[str, List[str]]]] = None
+toolkit = None
+lock = Lock()
+
+
+def get_toolkit():
+    """Get Biolink model toolkit, loading it on first use."""
+    global toolkit
+    if toolkit is None:
+        from bmt import Toolkit
+        toolkit = Toolkit()
+    return toolkit
+
+
+def camelcase_to_snakecase(string):
+    """Convert CamelCase to snake_case."""
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", string).lower()
+
+
+def subcategories(category) -> List[str]:
+    """Compute sub-categories with BMT."""
+    return [
+        descendant.replace("_", "")
+        for descendant in get_toolkit().get_descendants(category, formatted=True, reflexive=True)
+    ]
+
+
+def subpredicates(predicate) -> List[str]:
+    """Compute sub-predicates with BMT."""
+    curies = get_toolkit().get_descendants(predicate, formatted=True, reflexive=True)
+    return [
+        "biolink:" + camelcase_to_snakecase(curie[8:])
+        for curie in curies
+    ]
+
+
+def category_curie(name: str) -> str:
+    """Get CURIE of a class name, e.g. "named thing" -> biolink:NamedThing."""
+    return "biolink:" + "".join(word[:1].upper() + word[1:] for word in name.split(" "))
+
+
+def predicate_curie(name: str) -> str:
+    """Get CURIE of a slot name, e.g. "related to" -> biolink:related_to."""
+    return "biolink:" + name.replace(" ", "_")
+
+
+def build() -> Dict[str, Dict[str, List[str]]]:
+    """Build index of every class and slot of the Biolink model."""
+    return {
+        "categories": {
+            category_curie(name): subcategories(category_curie(name))
+            for name in get_toolkit().get_all_classes()
+        },
+        "predicates": {
+            predicate_curie(name): subpredicates(predicate_curie(name))
+            for name in get_toolkit().get_all_slots()
+        },
+    }
+
+
+def get_index() -> Dict[str, Dict[str, List[str]]]:
+    """Get index, loading it on first use."""
+    global index
+    if index is None:
+        with lock:
+            if index is None:
+                try:
+                    with open(INDEX_PATH, "r") as stream:
+                        index = json.load(stream)
+                except FileNotFoundError:
+                    logger.warning(
+                        f"no Biolink index at {INDEX_PATH}; falling back to BMT"
+                    )
+                    index = {"categories": {}, "predicates": {}}
+    return index
+
+
+@lru_cache(maxsize=FALLBACK_CACHE_SIZE)
+def fallback_subcategories(category) -> List[str]:
+    """Compute sub-categories of a term missing from the index."""
+    return subcategories(category)
+
+
+@lru_cache(maxsize=FALLBACK_CACHE_SIZE)
+def fallback_subpredicates(predicate) -> List[str]:
+    """Compute sub-predicates of a term missing from the index."""
+    return subpredicates(predicate)
+
+
+def get_subcategories(category) -> List[str]:
+    """Get sub-categories, according to the Biolink model."""
+    categories = get_index()["categories"]
+    if category not in categories:
+        return fallback_subcategories(category)
+    return categories[category]
+
+
+def get_subpredicates(predicate) -> List[str]:
+    """Get sub-predicates, according to the Biolink model."""
+    predicates = get_index()["predicates"]
+    if predicate not in predicates:
+        return fallback_subpredicates(predicate)
+    return predicates[predicate]
+
+
+def main():
+    """Compile Biolink hierarchy index."""
+    parser = argparse.ArgumentParser(description="Compile Biolink hierarchy index.")
+    parser.add_argument("--out", default=INDEX_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.time()
+    built = build()
+    with open(args.out, "w") as stream:
+        json.dump(built, stream)
+    logger.info(
+        f"{time.time() - start_time} seconds spent indexing "
+        f"{len(built['categories'])} categories and "
+        f"{len(built['predicates'])} predicates"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Bitmap index over columnar tables.
+
+Rows are partitioned by year, and the index holds one packed bitset per
+(feature, level, year), over the rows of that year's partition. Cohort
+filters are evaluated as bitwise OR (over the levels satisfying a qualifier)
+and AND (over features) of those bitsets.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(bits: np.ndarray) -> int:
+    """Count set bits in a packed bitset."""
+    return int(POPCOUNT[bits].sum(dtype=np.int64))
+
+
+class BitmapIndex():
+    """Bitmap index."""
+
+    def __init__(self, table):
+        """Build index for a columnar table."""
+        self.table = table
+        year = table.column("year")
+        self.order = np.argsort(year.codes, kind="stable")
+        sorted_years = year.codes[self.order]
+        self.partitions: Dict[object, Tuple[int, int]] = {}
+        for code, level in enumerate(year.levels):
+            start, end = np.searchsorted(sorted_years, [code, code + 1])
+            if end > start:
+                self.partitions[level] = (int(start), int(end))
+        self.id_values, self.id_codes = np.unique(table.ids, return_inverse=True)
+        self.n_ids = int(self.id_codes.max()) + 1 if len(table) else 0
+        self.bitsets: Dict[Tuple[str, int, object], np.ndarray] = {}
+        for name, column in table.columns.items():
+            if name == "year":
+                continue
+            sorted_codes = column.codes[self.order]
+            for year_level, (start, end) in self.partitions.items():
+                codes = sorted_codes[start:end]
+                for code in np.unique(codes):
+                    self.bitsets[name, int(code), year_level] = np.packbits(codes == code)
+
+    def years(self, year) -> List:
+        """Get partitions covered by year; None covers all."""
+        if year is None:
+            return list(self.partitions)
+        return [year] if year in self.partitions else []
+
+    def evaluate(self, features, year) -> Dict[object, np.ndarray]:
+        """Evaluate cohort features for each partition covered by year."""
+        result = {}
+        for year_level in self.years(year):
+            start, end = self.partitions[year_level]
+            bits = np.packbits(np.ones(end - start, dtype=bool))
+            for feature in features:
+                name = feature["feature_name"]
+                level_mask = self.table.column(name).level_mask(feature["feature_qualifier"])
+                feature_bits = np.zeros_like(bits)
+                for code in np.flatnonzero(level_mask):
+                    level_bits = self.bitsets.get((name, int(code), year_level))
+                    if level_bits is not None:
+                        feature_bits |= level_bits
+                bits &= feature_bits
+            result[year_level] = bits
+        return result
+
+    def rows(self, partition_bits: Dict[object, np.ndarray]) -> np.ndarray:
+        """Get boolean mask over table rows from partition bitsets."""
+        mask = np.zeros(len(self.table), dtype=bool)
+        for year_level, bits in partition_bits.items():
+            start, end = self.partitions[year_level]
+            mask[self.order[start:end]] = np.unpackbits(bits, count=end - start).view(bool)
+        return mask
+
+    def mask(self, cohort_features) -> Optional[np.ndarray]:
+        """Get boolean mask over rows satisfying all cohort features.
+
+        Like the SQL cohort filter, feature years are not considered here.
+        """
+        if not cohort_features:
+            return None
+        return self.rows(self.evaluate(cohort_features, None))
+
+    def cohort_id_counts(self, cohort_features, cohort_year) -> np.ndarray:
+        """Count, for each id, the rows of the joined cohort tables.
+
+        This mirrors sql.generate_tables_from_features: features are grouped
+        by year, and the per-year groups are joined on the id column.
+        """
+        groups = defaultdict(list)
+        for feature in cohort_features:
+            groups[feature["year"]].append(feature)
+        if not groups:
+            groups[cohort_year] = []
+        counts = None
+        for year, features in groups.items():
+            group_counts = np.bincount(
+                self.id_codes[self.rows(self.evaluate(features, year))],
+                minlength=self.n_ids,
+            )
+            counts = group_counts if counts is None else counts * group_counts
+        return counts
+
+    def cohort_size(self, cohort_features, cohort_year) -> int:
+        """Get cohort size."""
+        groups = {feature["year"] for feature in cohort_features}
+        if len(groups) <= 1:
+            year = next(iter(groups)) if groups else cohort_year
+            return sum(
+                popcount(bits)
+                for bits in self.evaluate(cohort_features, year).values()
+            )
+        return int(self.cohort_id_counts(cohort_features, cohort_year).sum())
+
+    def profile(self, names, cohort_features, cohort_year, year) -> Dict[str, np.ndarray]:
+        """Count the rows of each level of each column, joined with the cohort.
+
+        This mirrors sql.generate_tables_from_features: the rows of year
+        (all rows if None) are joined on the id column with the cohort, so
+        each row is weighted by the number of joined cohort rows of its id.
+        """
+        weights = self.cohort_id_counts(cohort_features, cohort_year)[self.id_codes]
+        if year is not None:
+            weights = weights * self.table.column("year").mask({"operator": "=", "value": year})
+        return {
+            name: np.bincount(
+                self.table.column(name).codes,
+                weights=weights,
+                minlength=len(self.table.column(name).levels),
+            ).astype(np.int64)
+            for name in names
+        }
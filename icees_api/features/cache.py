@@ -0,0 +1,405 @@
+"""Two-tier cache of computed results.
+
+A bounded in-process LRU tier, sized by bytes, sits in front of a shared
+backend, selected by ICEES_CACHE_BACKEND:
+* redis (default), at REDIS_HOST;
+* memory: the in-process tier only;
+* disk: an SQLite file at ICEES_CACHE_PATH, shared by the workers of a host;
+* none: no caching at all.
+A backend that fails, e.g. an unreachable redis, is skipped for
+RETRY_INTERVAL seconds, so that a cache outage only costs recomputation.
+
+Keys are namespaced and versioned:
+
+    icees:v1:<namespace>:<dataset version>:<table>:<cohort digest>:<parts>
+
+so that entries computed for one cohort or dataset are never served for
+another, and entries expire from both tiers after ICEES_CACHE_TTL seconds.
+The cohort digest is taken over the canonical cohort definition.
+
+Values are shared by every hit on the local tier, so callers must not
+mutate them. The local tier is per process: invalidating a key only drops
+it from this process's local tier, and other workers keep serving their
+copy until it expires or the dataset version changes.
+"""
+from collections import OrderedDict
+from functools import wraps
+from hashlib import md5
+import json
+import logging
+import os
+import sqlite3
+from threading import Lock
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from .canonical import canonical_json
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get("ICEES_CACHE_BACKEND", "redis")
+CACHE_PATH = os.environ.get("ICEES_CACHE_PATH", "icees_cache.db")
+REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+KEY_PREFIX = "icees:v1"
+# seconds; 0 means entries do not expire
+CACHE_TTL = int(os.environ.get("ICEES_CACHE_TTL", "604800"))
+# e.g. "2gb"; unset leaves the redis configuration alone
+REDIS_MAXMEMORY = os.environ.get("ICEES_REDIS_MAXMEMORY")
+REDIS_MAXMEMORY_POLICY = os.environ.get("ICEES_REDIS_MAXMEMORY_POLICY", "allkeys-lru")
+# seconds to skip a failed backend for
+RETRY_INTERVAL = 30
+# seconds; keeps requests from hanging on an unresponsive redis
+REDIS_TIMEOUT = 1
+
+# version of the data being served, e.g. the columnar snapshot version
+dataset_version = os.environ.get("ICEES_DATASET_VERSION", "unversioned")
+
+LOCAL_CACHE_BYTES = int(os.environ.get("ICEES_LOCAL_CACHE_BYTES", str(64 * 2 ** 20)))
+
+
+class Backend():
+    """Shared cache tier that caches nothing.
+
+    Subclasses implement _get, _set and _delete. Errors of the types in
+    `errors` are logged and disable the backend for RETRY_INTERVAL seconds.
+    """
+
+    name = "none"
+    errors: Tuple[type, ...] = ()
+
+    def __init__(self):
+        """Initialize."""
+        self.retry_at = 0.0
+
+    @property
+    def available(self) -> bool:
+        """Determine whether the backend is in use."""
+        return time.time() >= self.retry_at
+
+    def guarded(self, method: Callable, *args, default=None):
+        """Call method, unless the backend has failed recently."""
+        if not self.available:
+            return default
+        try:
+            return method(*args)
+        except self.errors as err:
+            logger.warning(
+                f"{self.name} cache failed, skipping it for "
+                f"{RETRY_INTERVAL} seconds: {err}"
+            )
+            self.retry_at = time.time() + RETRY_INTERVAL
+            return default
+
+    def get(self, key_: str) -> Optional[bytes]:
+        """Get serialized value, if cached."""
+        return self.guarded(self._get, key_)
+
+    def set(self, key_: str, value: bytes, ttl: Optional[int] = None):
+        """Cache serialized value, expiring after ttl seconds, if given."""
+        self.guarded(self._set, key_, value, ttl)
+
+    def delete(self, key_: str):
+        """Remove value."""
+        self.guarded(self._delete, key_)
+
+    def ttl(self, key_: str) -> Optional[float]:
+        """Get seconds to expiry of value, if cached and expiring."""
+        return None
+
+    def configure(self):
+        """Configure the backend."""
+
+    def _get(self, key_: str) -> Optional[bytes]:
+        return None
+
+    def _set(self, key_: str, value: bytes, ttl: Optional[int]):
+        pass
+
+    def _delete(self, key_: str):
+        pass
+
+
+class MemoryBackend(Backend):
+    """No shared tier; the in-process tier caches on its own."""
+
+    name = "memory"
+
+
+class RedisBackend(Backend):
+    """Redis cache."""
+
+    name = "redis"
+
+    def __init__(self, host: str, port: int = 6379):
+        """Initialize."""
+        super().__init__()
+        # including error replies, e.g. OOM under a noeviction policy
+        self.errors = (redis.exceptions.RedisError,)
+        self.client = redis.Redis(
+            host=host,
+            port=port,
+            socket_timeout=REDIS_TIMEOUT,
+            socket_connect_timeout=REDIS_TIMEOUT,
+        )
+
+    def ttl(self, key_: str) -> Optional[float]:
+        """Get seconds to expiry of value, if cached and expiring."""
+        ttl = self.guarded(self.client.ttl, key_)
+        return ttl if ttl is not None and ttl >= 0 else None
+
+    def configure(self):
+        """Bound redis memory, if configured.
+
+        A redis that refuses CONFIG SET, e.g. a managed one, is used as it is.
+        """
+        if REDIS_MAXMEMORY is None:
+            return
+        try:
+            self.client.config_set("maxmemory", REDIS_MAXMEMORY)
+            self.client.config_set("maxmemory-policy", REDIS_MAXMEMORY_POLICY)
+        except redis.exceptions.RedisError as err:
+            logger.warning(f"Failed to bound redis memory: {err}")
+            return
+        logger.info(
+            f"redis maxmemory set to {REDIS_MAXMEMORY} ({REDIS_MAXMEMORY_POLICY})"
+        )
+
+    def _get(self, key_: str) -> Optional[bytes]:
+        return self.client.get(key_)
+
+    def _set(self, key_: str, value: bytes, ttl: Optional[int]):
+        self.client.set(key_, value, ex=ttl or None)
+
+    def _delete(self, key_: str):
+        self.client.delete(key_)
+
+
+class SQLiteBackend(Backend):
+    """On-disk cache in an SQLite file."""
+
+    name = "disk"
+    errors = (sqlite3.Error,)
+
+    def __init__(self, path: str):
+        """Initialize."""
+        super().__init__()
+        self.lock = Lock()
+        self.connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+
+    def ttl(self, key_: str) -> Optional[float]:
+        """Get seconds to expiry of value, if cached and expiring."""
+        row = self.guarded(self._row, key_)
+        if row is None or row[1] is None:
+            return None
+        return row[1] - time.time()
+
+    def _row(self, key_: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires FROM cache WHERE key = ?", (key_,),
+            ).fetchone()
+            if row is not None and row[1] is not None and row[1] < time.time():
+                self.connection.execute("DELETE FROM cache WHERE key = ?", (key_,))
+                return None
+            return row
+
+    def _get(self, key_: str) -> Optional[bytes]:
+        row = self._row(key_)
+        return None if row is None else row[0]
+
+    def _set(self, key_: str, value: bytes, ttl: Optional[int]):
+        expires = time.time() + ttl if ttl else None
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key_, value, expires),
+            )
+
+    def _delete(self, key_: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM cache WHERE key = ?", (key_,))
+
+
+def create_backend(name: str) -> Backend:
+    """Create shared cache tier."""
+    if name == "redis":
+        if redis is None:
+            logger.warning("redis is not installed; caching in-process only")
+            return MemoryBackend()
+        return RedisBackend(REDIS_HOST)
+    if name == "disk":
+        return SQLiteBackend(CACHE_PATH)
+    if name == "memory":
+        return MemoryBackend()
+    if name == "none":
+        return Backend()
+    raise ValueError(f"Unknown cache backend '{name}'")
+
+
+backend = create_backend(CACHE_BACKEND)
+
+
+class LRUCache():
+    """In-process LRU cache bounded by the (serialized) size of its values."""
+
+    def __init__(self, max_bytes: int):
+        """Initialize."""
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries: "OrderedDict[str, Tuple[Any, int, Optional[float]]]" = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key_: str) -> Optional[Any]:
+        """Get value, if cached and not expired."""
+        with self.lock:
+            entry = self.entries.get(key_)
+            if entry is None:
+                return None
+            value, _, expires = entry
+            if expires is not None and expires < time.time():
+                self._remove(key_)
+                return None
+            self.entries.move_to_end(key_)
+            return value
+
+    def put(self, key_: str, value: Any, size: int, ttl: Optional[float] = None):
+        """Cache value, evicting least-recently-used values to make room."""
+        size += len(key_)
+        with self.lock:
+            self._remove(key_)
+            if size > self.max_bytes:
+                return
+            while self.n_bytes + size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+            expires = time.time() + ttl if ttl else None
+            self.entries[key_] = (value, size, expires)
+            self.n_bytes += size
+
+    def delete(self, key_: str):
+        """Remove value."""
+        with self.lock:
+            self._remove(key_)
+
+    def clear(self):
+        """Remove all values."""
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+    def _remove(self, key_: str):
+        """Remove value; the lock must be held."""
+        entry = self.entries.pop(key_, None)
+        if entry is not None:
+            self.n_bytes -= entry[1]
+
+
+local = LRUCache(0 if CACHE_BACKEND == "none" else LOCAL_CACHE_BYTES)
+counters: Dict[str, Dict[str, int]] = {
+    "local": {"hits": 0, "misses": 0},
+    "shared": {"hits": 0, "misses": 0},
+}
+
+
+def count(tier: str, hit: bool):
+    """Count a hit or miss."""
+    with local.lock:
+        counters[tier]["hits" if hit else "misses"] += 1
+
+
+def statistics() -> Dict[str, Dict[str, int]]:
+    """Get per-tier hit/miss counters, local tier usage and the backend in use."""
+    with local.lock:
+        tier_counters = {tier: dict(counts) for tier, counts in counters.items()}
+    return {
+        **tier_counters,
+        "backend": {"name": backend.name, "available": backend.available},
+        "local_usage": {
+            "entries": len(local.entries),
+            "bytes": local.n_bytes,
+            "max_bytes": local.max_bytes,
+        },
+    }
+
+
+def cohort_digest(year, cohort_features) -> str:
+    """Get digest of canonical cohort definition."""
+    return md5(canonical_json(year, cohort_features).encode("utf-8")).hexdigest()
+
+
+def key(namespace: str, table_name: str, year, cohort_features, *parts) -> str:
+    """Build cache key."""
+    return ":".join([
+        KEY_PREFIX,
+        namespace,
+        str(dataset_version),
+        table_name,
+        cohort_digest(year, cohort_features),
+        json.dumps(parts, sort_keys=True),
+    ])
+
+
+def load(key_: str) -> Optional[Any]:
+    """Get cached value, if any, from the local tier, then from the backend."""
+    value = local.get(key_)
+    count("local", value is not None)
+    if value is not None:
+        return value
+    cached_result = backend.get(key_)
+    count("shared", cached_result is not None)
+    if cached_result is None:
+        return None
+    value = json.loads(cached_result)
+    # expire locally with the shared entry, not CACHE_TTL after this load
+    local.put(key_, value, len(cached_result), backend.ttl(key_))
+    return value
+
+
+def store(key_: str, value: Any):
+    """Cache value in both tiers."""
+    serialized = json.dumps(value).encode("utf-8")
+    backend.set(key_, serialized, CACHE_TTL)
+    local.put(key_, value, len(serialized), CACHE_TTL)
+
+
+def invalidate(key_: str):
+    """Remove cached value from the backend and this process's local tier."""
+    local.delete(key_)
+    backend.delete(key_)
+
+
+def configure():
+    """Configure the backend."""
+    logger.info(f"caching with the {backend.name} backend")
+    backend.configure()
+
+
+def cached(key: Callable[..., str]):
+    """Generate a decorator to cache results."""
+    def decorator(func):
+        """Decorate a function to cache results."""
+        @wraps(func)
+        def wrapper(*args):
+            key_ = key(*args)
+            cached_result = load(key_)
+            if cached_result is not None:
+                return cached_result
+            result = func(*args)
+            store(key_, result)
+            return result
+        return wrapper
+    return decorator
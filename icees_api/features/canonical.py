@@ -0,0 +1,182 @@
+"""Canonical form of cohort definitions.
+
+Semantically identical cohort definitions should share cohort ids and cache
+entries. The canonical form of a definition:
+* is a list of {"feature_name", "feature_qualifier", "year"} dicts, with an
+  explicit year;
+* has one "=" qualifier instead of a singleton "in", and sorted, distinct
+  "in" values;
+* merges the predicates on each (feature, year): value sets are intersected
+  and filtered by "<>" predicates, numeric bounds are tightened, and a lower
+  and an upper inclusive bound become "between";
+* is sorted.
+
+Bounds are only compared, and value sets only filtered by bounds, for
+numbers: the database may order strings differently than Python does.
+The canonical form is used for keys and digests, not in responses.
+"""
+import json
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+LOWER = {">": False, ">=": True}
+UPPER = {"<": False, "<=": True}
+
+
+def is_number(value) -> bool:
+    """Determine whether value is a (non-boolean) number."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def sort_key(value) -> str:
+    """Get sort key for values of any JSON type."""
+    return json.dumps(value, sort_keys=True)
+
+
+def value_set(values) -> List:
+    """Get sorted, distinct values."""
+    return sorted({sort_key(value): value for value in values}.values(), key=sort_key)
+
+
+def set_qualifier(values) -> Dict[str, Any]:
+    """Get qualifier for a set of values."""
+    values = value_set(values)
+    if len(values) == 1:
+        return {"operator": "=", "value": values[0]}
+    return {"operator": "in", "values": values}
+
+
+def tighter(bound_a, bound_b, lower) -> Tuple[Any, bool]:
+    """Get the tighter of two numeric (value, inclusive) bounds."""
+    (value_a, inclusive_a), (value_b, inclusive_b) = bound_a, bound_b
+    if value_a == value_b:
+        return value_a, inclusive_a and inclusive_b
+    if (value_a > value_b) == lower:
+        return bound_a
+    return bound_b
+
+
+def satisfies(value, lower, upper) -> bool:
+    """Determine whether a number is within bounds."""
+    if lower is not None:
+        bound, inclusive = lower
+        if value < bound or (value == bound and not inclusive):
+            return False
+    if upper is not None:
+        bound, inclusive = upper
+        if value > bound or (value == bound and not inclusive):
+            return False
+    return True
+
+
+def merge_qualifiers(qualifiers) -> List[Dict[str, Any]]:
+    """Merge the qualifiers of a conjunction on one feature."""
+    values: Optional[List] = None
+    lowers, uppers, others = [], [], []
+    for qualifier in qualifiers:
+        op = qualifier["operator"]
+        if op in ("=", "in"):
+            new_values = [qualifier["value"]] if op == "=" else qualifier["values"]
+            if values is None:
+                values = value_set(new_values)
+            else:
+                keys = {sort_key(value) for value in new_values}
+                values = [value for value in values if sort_key(value) in keys]
+        elif op == "between":
+            lowers.append((qualifier["value_a"], True))
+            uppers.append((qualifier["value_b"], True))
+        elif op in LOWER:
+            lowers.append((qualifier["value"], LOWER[op]))
+        elif op in UPPER:
+            uppers.append((qualifier["value"], UPPER[op]))
+        else:
+            others.append(qualifier)
+
+    lowers = tighten(lowers, lower=True)
+    uppers = tighten(uppers, lower=False)
+    if values is not None and all(is_number(value) for value in values):
+        numeric = [bound for bound in lowers + uppers if is_number(bound[0])]
+        if len(numeric) == len(lowers) + len(uppers):
+            lower = lowers[0] if lowers else None
+            upper = uppers[0] if uppers else None
+            values = [value for value in values if satisfies(value, lower, upper)]
+            lowers, uppers = [], []
+
+    if values is not None:
+        excluded = {
+            sort_key(qualifier["value"])
+            for qualifier in others
+            if qualifier["operator"] == "<>"
+        }
+        values = [value for value in values if sort_key(value) not in excluded]
+        others = [qualifier for qualifier in others if qualifier["operator"] != "<>"]
+
+    merged = []
+    if values is not None:
+        merged.append(set_qualifier(values))
+    if len(lowers) == 1 and len(uppers) == 1 and lowers[0][1] and uppers[0][1]:
+        if lowers[0][0] == uppers[0][0]:
+            merged.append({"operator": "=", "value": lowers[0][0]})
+        else:
+            merged.append({
+                "operator": "between",
+                "value_a": lowers[0][0],
+                "value_b": uppers[0][0],
+            })
+    else:
+        merged.extend(
+            {"operator": ">=" if inclusive else ">", "value": value}
+            for value, inclusive in lowers
+        )
+        merged.extend(
+            {"operator": "<=" if inclusive else "<", "value": value}
+            for value, inclusive in uppers
+        )
+    merged.extend(others)
+    return value_set(merged)
+
+
+def tighten(bounds, lower) -> List[Tuple[Any, bool]]:
+    """Reduce numeric bounds to the tightest one; keep other bounds as is."""
+    numeric = [bound for bound in bounds if is_number(bound[0])]
+    others = [
+        bound for bound in value_set(bounds)
+        if not is_number(bound[0])
+    ]
+    if numeric:
+        tightest = numeric[0]
+        for bound in numeric[1:]:
+            tightest = tighter(tightest, bound, lower)
+        others.insert(0, tightest)
+    return [tuple(bound) for bound in others]
+
+
+def canonical_features(year, cohort_features) -> List[Dict[str, Any]]:
+    """Get canonical form of cohort features."""
+    if isinstance(cohort_features, dict):
+        cohort_features = [
+            {"feature_name": key, "feature_qualifier": value}
+            for key, value in cohort_features.items()
+        ]
+    qualifiers = defaultdict(list)
+    for feature in cohort_features:
+        qualifiers[
+            feature["feature_name"], feature.get("year", year)
+        ].append(feature["feature_qualifier"])
+    return sorted(
+        (
+            {
+                "feature_name": feature_name,
+                "feature_qualifier": qualifier,
+                "year": feature_year,
+            }
+            for (feature_name, feature_year), feature_qualifiers in qualifiers.items()
+            for qualifier in merge_qualifiers(feature_qualifiers)
+        ),
+        key=sort_key,
+    )
+
+
+def canonical_json(year, cohort_features) -> str:
+    """Get canonical JSON of cohort features."""
+    return json.dumps(canonical_features(year, cohort_features), sort_keys=True)
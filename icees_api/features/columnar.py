@@ -0,0 +1,283 @@
+"""In-memory columnar cohort engine.
+
+Each table is held as NumPy arrays of dictionary-encoded categorical codes.
+Codes follow the level order in value_sets.yml; values missing from the
+value set (including NULL) get codes appended after the known levels.
+Contingency tables are computed with np.bincount over combined codes.
+"""
+import logging
+import operator
+import os
+from threading import Lock
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .bitmap import BitmapIndex
+from .mappings import value_sets
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR = os.environ.get("ICEES_COLUMNAR", "false").lower() in ("1", "true", "yes")
+FETCH_SIZE = int(os.environ.get("ICEES_COLUMNAR_FETCH_SIZE", "100000"))
+
+COMPARATORS = {
+    "=": operator.eq,
+    "<>": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+
+
+def qualifier_holds(value, qualifier) -> bool:
+    """Determine whether a value satisfies a feature qualifier.
+
+    NULL never satisfies a qualifier, as in SQL, where comparing NULL gives
+    NULL. This includes "<>": a NULL value is not selected by
+    {"operator": "<>", "value": x}, as the SQL filter does not select it.
+    """
+    if value is None:
+        return False
+    op = qualifier["operator"]
+    try:
+        if op == "in":
+            return value in qualifier["values"]
+        if op == "between":
+            return qualifier["value_a"] <= value <= qualifier["value_b"]
+        return COMPARATORS[op](value, qualifier["value"])
+    except TypeError:
+        return False
+
+
+class Column():
+    """Dictionary-encoded column."""
+
+    def __init__(self, codes: np.ndarray, levels: List):
+        """Initialize."""
+        self.codes = codes
+        self.levels = levels
+
+    def level_mask(self, qualifier) -> np.ndarray:
+        """Get boolean mask over levels satisfying qualifier."""
+        return np.fromiter(
+            (qualifier_holds(level, qualifier) for level in self.levels),
+            dtype=bool,
+            count=len(self.levels),
+        )
+
+    def mask(self, qualifier) -> np.ndarray:
+        """Get boolean mask over rows satisfying qualifier."""
+        return self.level_mask(qualifier)[self.codes]
+
+
+def code_dtype(n_levels: int) -> np.dtype:
+    """Get the narrowest unsigned integer type holding n_levels codes."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_levels <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def fill(array: np.ndarray, values, start: int) -> np.ndarray:
+    """Write values into array from start, growing it if necessary."""
+    end = start + len(values)
+    if end > len(array):  # more rows than counted, e.g. inserted meanwhile
+        array = np.concatenate([array, np.empty(end - len(array), dtype=array.dtype)])
+    array[start:end] = values
+    return array
+
+
+class Encoder():
+    """Dictionary encoder of a column, filling preallocated codes chunk by chunk."""
+
+    def __init__(self, n_rows: int, levels: List = ()):
+        """Initialize."""
+        self.levels = list(levels)
+        self.index = {level: code for code, level in enumerate(self.levels)}
+        self.codes = np.empty(n_rows, dtype=np.uint32)
+
+    def code(self, value) -> int:
+        """Get code of value, adding a level if necessary."""
+        try:
+            return self.index[value]
+        except KeyError:
+            self.index[value] = len(self.levels)
+            self.levels.append(value)
+            return self.index[value]
+
+    def encode(self, values, start: int):
+        """Encode values into the codes of rows from start."""
+        self.codes = fill(self.codes, np.fromiter(
+            (self.code(value) for value in values),
+            dtype=self.codes.dtype,
+            count=len(values),
+        ), start)
+
+    def column(self, n_rows: int) -> Column:
+        """Get column of the first n_rows rows, with the narrowest codes."""
+        return Column(
+            self.codes[:n_rows].astype(code_dtype(len(self.levels))),
+            self.levels,
+        )
+
+
+class ColumnarTable():
+    """Columnar table."""
+
+    def __init__(self, name: str, ids: np.ndarray, columns: Dict[str, Column]):
+        """Initialize."""
+        self.name = name
+        self.ids = ids
+        self.columns = columns
+        # whether the table is served with a bitmap index, built on first use
+        self.indexed = False
+        self._index: Optional[BitmapIndex] = None
+        self._index_lock = Lock()
+
+    def __len__(self):
+        """Get number of rows."""
+        return len(self.ids)
+
+    @property
+    def index(self) -> Optional[BitmapIndex]:
+        """Get bitmap index, if the table is indexed."""
+        return self.build_index() if self.indexed else None
+
+    def build_index(self) -> BitmapIndex:
+        """Build bitmap index, unless already built."""
+        with self._index_lock:
+            if self._index is None:
+                start_time = time.time()
+                self._index = BitmapIndex(self)
+                logger.info(
+                    f"{time.time() - start_time} seconds spent indexing "
+                    f"table {self.name}"
+                )
+        return self._index
+
+    def column(self, name: str) -> Column:
+        """Get column by name."""
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError(f"No feature named '{name}'")
+
+    def mask(self, cohort_features) -> Optional[np.ndarray]:
+        """Get boolean mask over rows in cohort.
+
+        Like the SQL cohort filter, feature years are not considered here.
+        """
+        if self.index is not None:
+            return self.index.mask(cohort_features)
+        mask = None
+        for feature in cohort_features:
+            feature_mask = self.column(feature["feature_name"]).mask(
+                feature["feature_qualifier"],
+            )
+            mask = feature_mask if mask is None else mask & feature_mask
+        return mask
+
+    def contingency(self, *names, mask=None) -> np.ndarray:
+        """Count rows for each combination of levels."""
+        columns = [self.column(name) for name in names]
+        shape = tuple(len(col.levels) for col in columns)
+        combined = np.ravel_multi_index(
+            [col.codes for col in columns],
+            shape,
+        )
+        if mask is not None:
+            combined = combined[mask]
+        return np.bincount(
+            combined,
+            minlength=int(np.prod(shape)),
+        ).reshape(shape)
+
+    def count_unique(self, *names, mask=None) -> List[List]:
+        """Count each unique combination of column values.
+
+        The result has the same shape as that of sql.count_unique.
+        """
+        counts = self.contingency(*names, mask=mask)
+        levels = [self.column(name).levels for name in names]
+        return [
+            [
+                *(levels[dim][code] for dim, code in enumerate(index)),
+                int(counts[index]),
+            ]
+            for index in zip(*np.nonzero(counts))
+        ]
+
+
+def load_table(conn, table_name: str) -> ColumnarTable:
+    """Load table from database.
+
+    Rows are fetched FETCH_SIZE at a time and encoded as they arrive, into
+    code arrays preallocated for the row count.
+    """
+    start_time = time.time()
+    primary_key = table_name[0].upper() + table_name[1:] + "Id"
+    n_rows = conn.execute(f"SELECT COUNT(*) FROM {table_name}").scalar()
+    result = conn.execute(f"SELECT * FROM {table_name}")
+    names = list(result.keys())
+    ids = np.empty(n_rows, dtype=object)
+    encoders = {
+        name: Encoder(n_rows, value_sets.get(name, []))
+        for name in names
+        if name != primary_key
+    }
+    n = 0
+    while rows := result.fetchmany(FETCH_SIZE):
+        for name, column_values in zip(names, zip(*rows)):
+            if name == primary_key:
+                ids = fill(ids, column_values, n)
+            else:
+                encoders[name].encode(column_values, n)
+        n += len(rows)
+    columns = {
+        name: encoder.column(n)
+        for name, encoder in encoders.items()
+    }
+    logger.info(
+        f"{time.time() - start_time} seconds spent loading "
+        f"{n} rows of table {table_name}"
+    )
+    return ColumnarTable(table_name, ids[:n], columns)
+
+
+tables: Dict[str, ColumnarTable] = {}
+
+
+def load(conn, table_names):
+    """Load tables into the engine.
+
+    Loaded tables keep being served until all new ones are built, and are
+    then replaced at once.
+    """
+    loaded = {}
+    for table_name in table_names:
+        if not conn.engine.dialect.has_table(conn, table_name):
+            logger.warning(f"No table named {table_name}, not loading it")
+            continue
+        table = load_table(conn, table_name)
+        table.indexed = True
+        table.build_index()
+        loaded[table_name] = table
+    tables.update(loaded)
+
+
+def register(table: ColumnarTable):
+    """Add table to the engine.
+
+    Its bitmap index is built on first use, so that a worker serving a
+    snapshot does not pay for indexing every table at startup.
+    """
+    table.indexed = True
+    tables[table.name] = table
+
+
+def get_table(table_name: str) -> Optional[ColumnarTable]:
+    """Get loaded table, if any."""
+    return tables.get(table_name)
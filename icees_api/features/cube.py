@@ -0,0 +1,176 @@
+"""Precomputed all-pairs contingency cube.
+
+The cube holds, for a table, the level-by-level count matrix of every
+pair of features, over all years, as feature associations are counted.
+It is written offline as a flat binary file of int64 counts plus a JSON
+manifest, and served through np.memmap so that workers share it through
+the page cache.
+
+Build it with
+    python -m icees_api.features.cube --table patient --out <cube path>
+from the columnar snapshot at ICEES_SNAPSHOT_PATH if there is one, and
+from the database otherwise. The manifest records the dataset version the
+cube was built from; a cube of another version than the one served is not
+used, so it must be rebuilt after each reload of the data.
+"""
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..db import DBConnection
+from ..dependencies import ConnectionWithTables
+from . import cache, dataset_version, snapshot
+from .columnar import load_table
+
+logger = logging.getLogger(__name__)
+
+CUBE_PATH = os.environ.get("ICEES_CUBE_PATH")
+CUBE_DTYPE = np.int64
+
+
+def build(columnar_table, version=None) -> Tuple[Dict, np.ndarray]:
+    """Build manifest and counts for a columnar table of a dataset version."""
+    feature_names = [name for name in columnar_table.columns if name != "year"]
+    features = {}
+    pairs = {}
+    blocks = []
+    offset = 0
+    for name in feature_names:
+        features[name] = columnar_table.column(name).levels
+    for i, name_a in enumerate(feature_names):
+        for name_b in feature_names[i:]:
+            counts = columnar_table.contingency(name_a, name_b)
+            pairs[f"{name_a}\t{name_b}"] = offset
+            blocks.append(counts.ravel())
+            offset += counts.size
+    manifest = {
+        "table": columnar_table.name,
+        "dataset_version": version,
+        "features": features,
+        "pairs": pairs,
+    }
+    counts = np.concatenate(blocks).astype(CUBE_DTYPE) if blocks else np.zeros(0, dtype=CUBE_DTYPE)
+    return manifest, counts
+
+
+def write(path, manifest: Dict, counts: np.ndarray):
+    """Write cube files."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    name = manifest["table"]
+    counts.tofile(path / f"{name}.cube")
+    with open(path / f"{name}.json", "w") as stream:
+        json.dump(manifest, stream)
+
+
+class Cube():
+    """Memory-mapped contingency cube."""
+
+    def __init__(self, manifest: Dict, counts: np.ndarray):
+        """Initialize."""
+        self.manifest = manifest
+        self.counts = counts
+        self.features: Dict[str, List] = manifest["features"]
+        self.pairs: Dict[str, int] = manifest["pairs"]
+
+    @classmethod
+    def open(cls, path, table_name) -> "Cube":
+        """Open cube files."""
+        with open(Path(path) / f"{table_name}.json", "r") as stream:
+            manifest = json.load(stream)
+        counts = np.memmap(Path(path) / f"{table_name}.cube", dtype=CUBE_DTYPE, mode="r")
+        return cls(manifest, counts)
+
+    def __contains__(self, feature_name) -> bool:
+        """Determine whether the cube covers a feature."""
+        return feature_name in self.features
+
+    def contingency(self, name_a, name_b) -> np.ndarray:
+        """Get level-by-level counts for a pair of features."""
+        levels_a = self.features[name_a]
+        levels_b = self.features[name_b]
+        key = f"{name_a}\t{name_b}"
+        if key not in self.pairs:
+            return self.contingency(name_b, name_a).T
+        offset = self.pairs[key]
+        size = len(levels_a) * len(levels_b)
+        return np.asarray(self.counts[offset:offset + size]).reshape(
+            len(levels_a), len(levels_b),
+        )
+
+    def count_unique(self, name_a, name_b) -> List[List]:
+        """Count each unique combination of feature values.
+
+        The result has the same shape as that of sql.count_unique.
+        """
+        counts = self.contingency(name_a, name_b)
+        levels_a = self.features[name_a]
+        levels_b = self.features[name_b]
+        return [
+            [levels_a[i], levels_b[j], int(counts[i, j])]
+            for i, j in zip(*np.nonzero(counts))
+        ]
+
+
+# cubes, by table, with the dataset version they were opened for
+cubes: Dict[str, Tuple[str, Optional[Cube]]] = {}
+
+
+def get_cube(table_name: str) -> Optional[Cube]:
+    """Get cube for the unfiltered population of a table, if built.
+
+    Cubes are reopened when the dataset version changes, and not used if
+    built from another version.
+    """
+    if CUBE_PATH is None:
+        return None
+    entry = cubes.get(table_name)
+    if entry is None or entry[0] != cache.dataset_version:
+        try:
+            cube = Cube.open(CUBE_PATH, table_name)
+        except FileNotFoundError:
+            cube = None
+        version = None if cube is None else cube.manifest.get("dataset_version")
+        if version is not None and version != cache.dataset_version:
+            logger.warning(
+                f"cube {table_name} is of dataset version {version}, "
+                f"not {cache.dataset_version}; not using it"
+            )
+            cube = None
+        entry = (cache.dataset_version, cube)
+        cubes[table_name] = entry
+    return entry[1]
+
+
+def main():
+    """Build cube from the database."""
+    parser = argparse.ArgumentParser(description="Build contingency cube.")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--out", default=CUBE_PATH, required=CUBE_PATH is None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if snapshot.SNAPSHOT_PATH is not None:
+        columnar_table = snapshot.read(snapshot.SNAPSHOT_PATH)[args.table]
+        version = dataset_version.current()
+    else:
+        with DBConnection() as conn:
+            columnar_table = load_table(conn, args.table)
+            version = dataset_version.current(ConnectionWithTables(conn))
+    start_time = time.time()
+    manifest, counts = build(columnar_table, version)
+    write(args.out, manifest, counts)
+    logger.info(
+        f"{time.time() - start_time} seconds spent building cube of "
+        f"{len(manifest['pairs'])} feature pairs"
+    )
+
+
+if __name__ == "__main__":
+    main()
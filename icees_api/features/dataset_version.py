@@ -0,0 +1,196 @@
+"""Version of the data in the database.
+
+Cached results are keyed by the dataset version (cache.dataset_version), so
+a reload of the data invalidates them without flushing any cache. The
+version is, in order of preference:
+* ICEES_DATASET_VERSION, if set;
+* the version of the columnar snapshot, if one is served;
+* the latest version stamped in the dataset_version table, which the loader
+  should write after each reload with
+      python -m icees_api.features.dataset_version --stamp [<version>]
+* otherwise, a fingerprint of the data tables: their row counts, id ranges
+  and columns. This misses reloads that only change values.
+
+The database version is read at startup and re-read by a background
+thread every ICEES_DATASET_VERSION_INTERVAL seconds, off the request path.
+When it changes, tables loaded into the columnar engine are rebuilt and
+swapped in, and cubes built from other versions are no longer used.
+"""
+import argparse
+from datetime import datetime, timezone
+from hashlib import md5
+import json
+import logging
+import os
+from threading import Event, Lock, Thread
+from typing import Iterable, Optional
+
+from sqlalchemy import column, func, table
+from sqlalchemy.sql import select
+
+from ..db import DBConnection
+from ..dependencies import ConnectionWithTables
+from . import cache, columnar, snapshot
+
+logger = logging.getLogger(__name__)
+
+VERSION_TABLE = "dataset_version"
+DATA_TABLES = ("patient", "visit")
+# seconds between checks of the database version
+CHECK_INTERVAL = int(os.environ.get("ICEES_DATASET_VERSION_INTERVAL", "60"))
+
+lock = Lock()
+stopped = Event()
+watcher: Optional[Thread] = None
+
+
+def tracking() -> bool:
+    """Determine whether the version is read from the database."""
+    return "ICEES_DATASET_VERSION" not in os.environ and snapshot.SNAPSHOT_PATH is None
+
+
+def create_table(conn):
+    """Create dataset version table, if necessary."""
+    if VERSION_TABLE in conn.tables:
+        return
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        "version varchar(255), "
+        "stamped_at timestamp"
+        ")"
+    )
+    conn.refresh_tables()
+
+
+def fingerprint(conn, table_names: Iterable[str] = DATA_TABLES) -> str:
+    """Get fingerprint of the data tables."""
+    c = md5()
+    for table_name in table_names:
+        if table_name not in conn.tables:
+            continue
+        columns = list(conn.tables[table_name].columns.keys())
+        id_column = next(
+            (name for name in columns if name.lower() == table_name.lower() + "id"),
+            None,
+        )
+        aggregates = [func.count()]
+        if id_column is not None:
+            aggregates += [func.min(column(id_column)), func.max(column(id_column))]
+        row = conn.execute(select(aggregates).select_from(table(table_name))).first()
+        c.update(json.dumps([table_name, columns, list(row)], default=str).encode("utf-8"))
+    return f"fingerprint-{c.hexdigest()[:12]}"
+
+
+def read(conn) -> str:
+    """Get version of the data in the database.
+
+    The data tables are only fingerprinted when no version is stamped.
+    """
+    if conn.engine.dialect.has_table(conn.connection, VERSION_TABLE):
+        version: Optional[str] = conn.execute(
+            select([column("version")])
+            .select_from(table(VERSION_TABLE))
+            .order_by(column("stamped_at").desc())
+            .limit(1)
+        ).scalar()
+        if version is not None:
+            return version
+    return fingerprint(conn)
+
+
+def stamp(conn, version: str = None) -> str:
+    """Stamp a new version of the data."""
+    create_table(conn)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    if version is None:
+        version = f"{now:%Y%m%dT%H%M%S}-{fingerprint(conn)}"
+    conn.execute(
+        table(VERSION_TABLE, column("version"), column("stamped_at"))
+        .insert()
+        .values(version=version, stamped_at=now)
+    )
+    return version
+
+
+def current(conn=None) -> str:
+    """Get the version of the data served, in order of preference."""
+    if "ICEES_DATASET_VERSION" in os.environ:
+        return os.environ["ICEES_DATASET_VERSION"]
+    if snapshot.SNAPSHOT_PATH is not None:
+        return snapshot.read_manifest(snapshot.SNAPSHOT_PATH)["version"]
+    return read(conn)
+
+
+def update(conn) -> bool:
+    """Version the cache by the database version; return whether it changed.
+
+    On a change, the schema is re-reflected and the columnar tables are
+    rebuilt and swapped in before the version is bumped, so that no result
+    of the old data is cached under the new version. The local cache tier
+    is then cleared.
+    """
+    with lock:
+        version = read(conn)
+        if version == cache.dataset_version:
+            return False
+        logger.info(f"dataset version {cache.dataset_version} -> {version}")
+        conn.refresh_tables()
+        if columnar.tables:
+            columnar.load(conn, list(columnar.tables))
+        cache.dataset_version = version
+        cache.local.clear()
+        return True
+
+
+def watch(interval: float = CHECK_INTERVAL):
+    """Update the version from the database every interval seconds, until stopped."""
+    while not stopped.wait(interval):
+        try:
+            with DBConnection() as conn:
+                update(ConnectionWithTables(conn))
+        except Exception as err:  # keep watching after a failed check
+            logger.exception(f"Failed to check dataset version: {err}")
+
+
+def start():
+    """Start watching the database version in a background thread, if tracked."""
+    global watcher
+    if not tracking() or watcher is not None:
+        return
+    stopped.clear()
+    watcher = Thread(target=watch, name="dataset-version", daemon=True)
+    watcher.start()
+
+
+def stop():
+    """Stop watching the database version."""
+    global watcher
+    stopped.set()
+    if watcher is not None:
+        watcher.join()
+        watcher = None
+
+
+def main():
+    """Stamp or show the dataset version."""
+    parser = argparse.ArgumentParser(description="Manage dataset version.")
+    parser.add_argument(
+        "--stamp",
+        nargs="?",
+        const="",
+        default=None,
+        help="stamp a new version, by default derived from the time and data",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with DBConnection() as conn:
+        conn = ConnectionWithTables(conn)
+        if args.stamp is not None:
+            logger.info(f"stamped dataset version {stamp(conn, args.stamp or None)}")
+        else:
+            logger.info(f"dataset version {read(conn)}")
+
+
+if __name__ == "__main__":
+    main()
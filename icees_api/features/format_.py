@@ -1,5 +1,29 @@
+from typing import Optional
+
 from tabulate import tabulate
 
+from . import json_
+
+NDJSON = "application/x-ndjson"
+
+
+def accepts(accept: Optional[str], media_type: str) -> bool:
+    """Determine whether an Accept header lists a media type, with q > 0."""
+    for media_range in (accept or "").split(","):
+        name, *params = [part.strip() for part in media_range.split(";")]
+        if name.lower() != media_type:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
 def feature_to_text(feature_name, feature_qualifier):
     op_form = {
         ">": lambda x: str(x["value"]),
@@ -29,6 +53,26 @@ def format_tabular(term, data):
     return string
 
 
+# the compact format replaces these with flat counts, in row-major order, and margins
+VERBOSE_KEYS = ("feature_matrix", "rows", "columns")
+
+
+def format_compact(association):
+    return {
+        **{key: value for key, value in association.items() if key not in VERBOSE_KEYS},
+        "shape": [len(association["rows"]), len(association["columns"])],
+        "counts": [cell["frequency"] for row in association["feature_matrix"] for cell in row],
+        "row_totals": [row["frequency"] for row in association["rows"]],
+        "column_totals": [column["frequency"] for column in association["columns"]],
+    }
+
+
+def format_ndjson(term, values):
+    yield json_.dumps({"terms and conditions": term}) + b"\n"
+    for value in values:
+        yield json_.dumps(value) + b"\n"
+
+
 def percentage_to_text(cell):
     return "{:0.2f}%".format(cell * 100)
 
@@ -76,6 +120,22 @@ def format_tables(data, tables):
         columns = ["cohort_id", "size"]
         rows = [[data["cohort_id"], data["size"]]]
         tables.append([columns, rows])
+    elif "feature_a" in data and "counts" in data:
+        feature_a = data["feature_a"]
+        feature_b = data["feature_b"]
+        n_columns = data["shape"][1]
+
+        columns = ["feature"] + [feature_to_text(feature_a["feature_name"], x) for x in feature_a["feature_qualifiers"]] + [""]
+        rows = [[feature_to_text(feature_b["feature_name"], x)] + data["counts"][i * n_columns:(i + 1) * n_columns] + [data["row_totals"][i]] for i, x in enumerate(feature_b["feature_qualifiers"])] + [[""] + data["column_totals"] + [data["total"]]]
+        tables.append([columns, rows])
+
+        columns = ["p_value", "chi_squared"]
+        rows = [[data["p_value"], data["chi_squared"]]]
+        p_value_corrected = data.get("p_value_corrected")
+        if p_value_corrected is not None:
+            columns.append("p_value_corrected")
+            rows[0].append(p_value_corrected)
+        tables.append([columns, rows])
     elif "feature_a" in data:
         feature_a = data["feature_a"]
         feature_b = data["feature_b"]
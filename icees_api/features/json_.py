@@ -0,0 +1,40 @@
+"""NaN-aware JSON encoding.
+
+NaN and infinities are encoded as null, and NumPy scalars and arrays as
+numbers and lists, while encoding. orjson is used if it is installed, and
+simplejson otherwise.
+"""
+from typing import Any
+
+import numpy as np
+import simplejson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def default(obj):
+    """Encode NumPy objects that the encoder does not handle itself."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+    return simplejson.dumps(
+        obj,
+        default=default,
+        ignore_nan=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
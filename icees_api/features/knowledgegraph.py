@@ -1,7 +1,7 @@
 """Knowledge graph methods."""
 import datetime
 from functools import reduce
-from itertools import combinations
+from itertools import combinations, product
 import logging
 import os
 import re
@@ -16,7 +16,10 @@ from tx.functional.utils import compose
 from ..utils import to_qualifiers
 from .mappings import mappings
 from .data_sources import data_sources
-from .sql import get_ids_by_feature, select_associations_to_all_features, select_feature_matrix, get_feature_levels
+from .sql import (
+    get_ids_by_feature, select_associations, select_associations_to_all_features,
+    get_feature_levels,
+)
 from .identifiers import get_identifiers, get_features_by_identifier
 from .qgraph_utils import normalize_qgraph
 
@@ -355,20 +358,26 @@ def query_feature(conn, table_name, feature):
     }
 
 
-def co_occurrence_feature_edge(
+def co_occurrence_feature_edges(
         conn,
         table,
         year,
         cohort_features,
-        src_feature,
-        tgt_feature,
+        feature_pairs,
 ):
-    """Get co-occurrence p-value."""
-    return select_feature_matrix(
-        conn, table, year, cohort_features, year,
-        query_feature(conn, table, src_feature),
-        query_feature(conn, table, tgt_feature),
-    )["p_value"]
+    """Get co-occurrence p-values of feature pairs, in one batch.
+
+    Associations are served from and stored in the association cache, if
+    enabled.
+    """
+    associations = select_associations(conn, table, year, cohort_features, year, [
+        (
+            query_feature(conn, table, src_feature),
+            query_feature(conn, table, tgt_feature),
+        )
+        for src_feature, tgt_feature in feature_pairs
+    ])
+    return [association["p_value"] for association in associations]
 
 
 def feature_names(table, node_curie):
@@ -385,22 +394,22 @@ def co_occurrence_edge(
         tgt_node,
 ):
     def handle_src_and_tgt_features(src_features, tgt_features):
-        edge_property_value = []
-        for src_feature in src_features:
-            for tgt_feature in tgt_features:
-                edge = co_occurrence_feature_edge(
-                    conn,
-                    table_name,
-                    year,
-                    cohort_features,
-                    src_feature,
-                    tgt_feature,
-                )
-                edge_property_value.append({
-                    "src_feature": src_feature,
-                    "tgt_feature": tgt_feature,
-                    "p_value": edge
-                })
+        feature_pairs = list(product(src_features, tgt_features))
+        edges = co_occurrence_feature_edges(
+            conn,
+            table_name,
+            year,
+            cohort_features,
+            feature_pairs,
+        )
+        edge_property_value = [
+            {
+                "src_feature": src_feature,
+                "tgt_feature": tgt_feature,
+                "p_value": edge
+            }
+            for (src_feature, tgt_feature), edge in zip(feature_pairs, edges)
+        ]
         if len(edge_property_value) == 0:
             raise RuntimeError("no edge found")
         return edge_property_value
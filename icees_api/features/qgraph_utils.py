@@ -1,31 +1,5 @@
 """Query graph utilities."""
-import re
-
-from bmt import Toolkit
-
-BMT = Toolkit()
-
-
-def get_subcategories(category):
-    """Get sub-categories, according to the Biolink model."""
-    return [
-        descendant.replace("_", "")
-        for descendant in BMT.get_descendants(category, formatted=True, reflexive=True)
-    ]
-
-
-def camelcase_to_snakecase(string):
-    """Convert CamelCase to snake_case."""
-    return re.sub(r"(?<!^)(?=[A-Z])", "_", string).lower()
-
-
-def get_subpredicates(predicate):
-    """Get sub-predicates, according to the Biolink model."""
-    curies = BMT.get_descendants(predicate, formatted=True, reflexive=True)
-    return [
-        "biolink:" + camelcase_to_snakecase(curie[8:])
-        for curie in curies
-    ]
+from .biolink import get_subcategories, get_subpredicates
 
 
 def normalize_qgraph(qgraph):
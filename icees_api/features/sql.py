@@ -1,27 +1,27 @@
 """SQL access functions."""
 from collections import defaultdict
-from datetime import datetime, timezone
-from functools import wraps
 from hashlib import md5
 from itertools import product, chain
 import json
 import logging
 import re
-import operator
 import os
 import time
-from typing import Any, Callable, Dict, List, Union
+import weakref
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
 
 from fastapi import HTTPException
 import numpy as np
-import redis
-from scipy.stats import chi2_contingency
-from sqlalchemy import and_, between, case, column, table
+from sqlalchemy import and_, between, case, column, literal_column, table, tuple_, union_all
 from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.sql import select, func
-from statsmodels.stats.multitest import multipletests
 from tx.functional.maybe import Nothing, Just
 
+from ..dependencies import ConnectionWithTables
+from . import association_cache, cache, columnar, cube, stats
+from .cache import cached
+from .canonical import canonical_json
 from .mappings import mappings, value_sets
 
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +29,6 @@ logger = logging.getLogger(__name__)
 
 eps = np.finfo(float).eps
 
-
 def get_digest(*args):
     """Get digest."""
     c = md5()
@@ -115,48 +114,225 @@ def select_cohort(conn, table_name, year, cohort_features, cohort_id=None):
     """Select cohort."""
     cohort_features_norm = normalize_features(year, cohort_features)
 
-    table, _ = generate_tables_from_features(table_name, cohort_features_norm, year, [])
+    columnar_table = columnar.get_table(table_name)
+    if columnar_table is not None:
+        n = columnar_table.index.cohort_size(cohort_features_norm, year)
+    else:
+        table, _ = generate_tables_from_features(table_name, cohort_features_norm, year, [])
 
-    s = select([func.count()]).select_from(table)
+        s = select([func.count()]).select_from(table)
 
-    n = conn.execute(s).scalar()
+        n = conn.execute(s).scalar()
     if n <= 10:
         return None, -1
     else:
         size = n
-        next_val = 0
-        while cohort_id is None:
-            next_val += 1
-            cohort_id = "COHORT:" + str(next_val)
-            if cohort_id_in_use(conn, cohort_id):
-                cohort_id = None
-
-        if cohort_id_in_use(conn, cohort_id):
-            raise HTTPException(status_code=400, detail="Cohort id is in use.")
-
-        query = "INSERT INTO cohort (cohort_id, size, features, \"table\", year)"
+        if cohort_id is not None and cohort_id_in_use(conn, cohort_id):
+            if not cohort_id_in_use(conn, cohort_id, table_name):
+                raise HTTPException(status_code=400, detail="Cohort id is in use.")
+            delete_cohort(conn, cohort_id, table_name)
+        if cohort_id is None:
+            cohort_id = allocate_cohort_id(conn)
+
+        ensure_cohort_digest(conn)
+        digest = cohort_digest(table_name, year, cohort_features)
+        if cohort_id_by_digest(conn, digest) is not None:
+            # another cohort is the canonical one for this definition
+            digest = None
+        query = "INSERT INTO cohort (cohort_id, size, features, \"table\", year, digest)"
         if os.environ.get("ICEES_DB", "sqlite") == "sqlite":
-            query += " VALUES (?, ?, ?, ?, ?)"
+            query += " VALUES (?, ?, ?, ?, ?, ?)"
         else:
-            query += " VALUES (%s, %s, %s, %s, %s)"
-        conn.execute(query, (
+            query += " VALUES (%s, %s, %s, %s, %s, %s)"
+        values = (
             cohort_id,
             size,
             json.dumps(cohort_features, sort_keys=True),
             table_name,
             year,
-        ))
+        )
+        try:
+            conn.execute(query, (*values, digest))
+        except IntegrityError:
+            # a concurrent request stored the same definition first
+            conn.execute(query, (*values, None))
         return cohort_id, size
 
 
+COHORT_ID_PREFIX = "COHORT:"
+cohort_id_counter = table("cohort_id_counter", column("next_val"))
+# engines whose cohort id sequence/counter is known to exist
+cohort_id_allocators = weakref.WeakSet()
+
+
+def cohort_number(cohort_id: str) -> Optional[int]:
+    """Get n of a COHORT:n id, None for other ids."""
+    suffix = cohort_id[len(COHORT_ID_PREFIX):]
+    if cohort_id.startswith(COHORT_ID_PREFIX) and suffix.isdigit():
+        return int(suffix)
+    return None
+
+
+def cohort_id_order(cohort_id: str):
+    """Get sort key ordering COHORT:n ids by n, then other ids."""
+    number = cohort_number(cohort_id)
+    return (number is None, number or 0, cohort_id)
+
+
+def max_cohort_number(conn) -> int:
+    """Get the largest n of existing COHORT:n ids."""
+    numbers = [0]
+    for cohort_id, in conn.execute(
+        select([column("cohort_id")])
+        .select_from(table("cohort"))
+        .where(column("cohort_id").like(COHORT_ID_PREFIX + "%"))
+    ):
+        number = cohort_number(cohort_id)
+        if number is not None:
+            numbers.append(number)
+    return max(numbers)
+
+
+def create_cohort_id_allocator(conn):
+    """Create cohort id sequence (postgres) or counter (sqlite), if necessary.
+
+    Either starts after the largest existing COHORT:n id.
+    """
+    if conn.engine in cohort_id_allocators:
+        return
+    if os.environ.get("ICEES_DB", "sqlite") == "sqlite":
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cohort_id_counter (next_val integer)"
+        )
+        with conn.begin():
+            if conn.execute(
+                select([func.count()]).select_from(cohort_id_counter)
+            ).scalar() == 0:
+                conn.execute(cohort_id_counter.insert().values(
+                    next_val=max_cohort_number(conn) + 1,
+                ))
+    else:
+        conn.execute("CREATE SEQUENCE IF NOT EXISTS cohort_id_seq")
+        max_number = max_cohort_number(conn)
+        if max_number > 0:
+            conn.execute(
+                "SELECT setval('cohort_id_seq', GREATEST({0}, "
+                "(SELECT last_value FROM cohort_id_seq)))".format(max_number)
+            )
+    cohort_id_allocators.add(conn.engine)
+
+
+def allocate_cohort_id(conn) -> str:
+    """Allocate a new COHORT:n id.
+
+    n comes from a sequence on postgres and from a counter row, incremented
+    in a transaction, on sqlite, so concurrent callers get distinct ids.
+    Ids taken explicitly (through PUT) are skipped.
+    """
+    create_cohort_id_allocator(conn)
+    while True:
+        if os.environ.get("ICEES_DB", "sqlite") == "sqlite":
+            with conn.begin():
+                conn.execute(cohort_id_counter.update().values(
+                    next_val=cohort_id_counter.c.next_val + 1,
+                ))
+                next_val = conn.execute(
+                    select([cohort_id_counter.c.next_val])
+                ).scalar() - 1
+        else:
+            next_val = conn.execute("SELECT nextval('cohort_id_seq')").scalar()
+        cohort_id = COHORT_ID_PREFIX + str(next_val)
+        if not cohort_id_in_use(conn, cohort_id):
+            return cohort_id
+
+
+def delete_cohort(conn, cohort_id, table_name=None):
+    """Delete cohort, of table_name if given."""
+    s = table("cohort", column("cohort_id"), column("table")).delete()\
+        .where(column("cohort_id") == cohort_id)
+    if table_name is not None:
+        s = s.where(column("table") == table_name)
+    conn.execute(s)
+
+
+def cohort_digest(table_name, year, cohort_features) -> str:
+    """Get digest of cohort definition."""
+    return get_digest(
+        json.dumps(table_name),
+        json.dumps(year),
+        canonical_json(year, cohort_features),
+    ).hex()
+
+
+def ensure_cohort_digest(conn):
+    """Add digest column and unique index to cohort table, if necessary.
+
+    Existing cohorts without a digest are backfilled; when several share a
+    definition, only the first keeps the digest and the others get NULL.
+    Another worker may be migrating concurrently, so every step tolerates
+    having been done already.
+    """
+    if "digest" in conn.tables["cohort"].c:
+        return
+    if os.environ.get("ICEES_DB", "sqlite") == "sqlite":
+        try:
+            conn.execute("ALTER TABLE cohort ADD COLUMN digest varchar(32)")
+        except OperationalError as err:
+            # added since the schema was reflected
+            if "duplicate column" not in str(err):
+                raise
+    else:
+        conn.execute("ALTER TABLE cohort ADD COLUMN IF NOT EXISTS digest varchar(32)")
+    cohort = table(
+        "cohort",
+        column("cohort_id"), column("table"), column("year"),
+        column("features"), column("digest"),
+    )
+    digests = {
+        digest for digest, in conn.execute(
+            select([cohort.c.digest]).where(cohort.c.digest.isnot(None))
+        )
+    }
+    rows = conn.execute(select([
+        cohort.c.cohort_id, cohort.c.table, cohort.c.year, cohort.c.features,
+    ]).where(cohort.c.digest.is_(None))).fetchall()
+    # the oldest cohort keeps the digest, as lookups used to find it first
+    for cohort_id, table_name, year, features in sorted(
+            rows,
+            key=lambda row: cohort_id_order(row[0]),
+    ):
+        digest = cohort_digest(table_name, year, json.loads(features))
+        if digest in digests:
+            continue
+        digests.add(digest)
+        conn.execute(
+            cohort.update()
+            .where(cohort.c.cohort_id == cohort_id)
+            .values(digest=digest)
+        )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS cohort_digest ON cohort (digest)"
+    )
+    conn.refresh_tables()
+
+
+def cohort_id_by_digest(conn, digest):
+    """Get id and size of the cohort with digest, if any."""
+    return conn.execute(
+        select([column("cohort_id"), column("size")])
+        .select_from(table("cohort"))
+        .where(column("digest") == digest)
+    ).first()
+
+
 def get_ids_by_feature(conn, table_name, year, cohort_features):
     """Get ids by feature."""
-    s = select([column("cohort_id"), column("size")])\
-        .select_from(table("cohort"))\
-        .where(column("table") == table_name)\
-        .where(column("year") == year)\
-        .where(column("features") == json.dumps(cohort_features, sort_keys=True))
-    rs = list(conn.execute(s))
+    ensure_cohort_digest(conn)
+    row = cohort_id_by_digest(
+        conn,
+        cohort_digest(table_name, year, cohort_features),
+    )
+    rs = [] if row is None else [row]
     if len(rs) == 0:
         cohort_id, size = select_cohort(conn, table_name, year, cohort_features)
     else:
@@ -201,25 +377,36 @@ def get_cohort_by_id(conn, table_name, year, cohort_id):
     }
 
 
+def cohort_profile_key(conn, table_name, year, cohort_features, cohort_year):
+    """Get cache key of get_cohort_features."""
+    return cache.key("profile", table_name, cohort_year, cohort_features, year)
+
+
+@cached(key=cohort_profile_key)
 def get_cohort_features(conn, table_name, year, cohort_features, cohort_year):
-    """Get cohort features."""
-    rs = []
-    for k in get_features(conn, table_name):
-        # k = f.name
-        # levels = f.options
-        # if levels is None:
-        levels = get_feature_levels(k)
-        ret = select_feature_count_all_values(
-            conn,
-            table_name,
+    """Get cohort features.
+
+    The whole profile is counted in one pass over the cohort rows, and
+    cached per cohort definition.
+    """
+    feature_names = get_features(conn, table_name)
+    profile = select_cohort_profile(
+        conn,
+        table_name,
+        year,
+        cohort_features,
+        cohort_year,
+        feature_names,
+    )
+    return [
+        feature_count_all_values(
+            feature_name,
             year,
-            cohort_features,
-            cohort_year,
-            k,
-            levels
+            get_feature_levels(feature_name),
+            profile[feature_name],
         )
-        rs.append(ret)
-    return rs
+        for feature_name in feature_names
+    ]
 
 
 def get_cohort_dictionary(conn, table_name, year):
@@ -259,13 +446,14 @@ def get_cohort_definition_by_id(conn, cohort_id):
     return Nothing 
 
 
-def cohort_id_in_use(conn, cohort_id):
-    """Determine whether cohort is in use."""
-    return conn.execute((
-        select([func.count()])
+def cohort_id_in_use(conn, cohort_id, table_name=None):
+    """Determine whether cohort is in use, by table_name if given."""
+    s = select([func.count()])\
         .select_from(table("cohort"))\
         .where(column("cohort_id") == cohort_id)
-    )).scalar() > 0
+    if table_name is not None:
+        s = s.where(column("table") == table_name)
+    return conn.execute(s).scalar() > 0
 
 
 def join_lists(lists):
@@ -340,7 +528,7 @@ def generate_tables_from_features(
         table_cohort_feature_group = table_cohort_feature_group.alias()
         table_cohorts.append(table_cohort_feature_group)
 
-    if len(cohort_feature_groups) == 0:
+    if len(table_cohorts) == 0:
         table_cohort_feature_group = (
             select([table_.c[primary_key]])\
             .select_from(table_)
@@ -438,56 +626,72 @@ def normalize_feature(year, feature):
     return feature
 
 
-OP_MAP = {
-    "=": operator.eq,
-    "<>": operator.ne,
-    "<": operator.lt,
-    ">": operator.gt,
-    "<=": operator.le,
-    ">=": operator.ge,
-    "in": lambda x, y: x in y,
-}
-
-
-def get_count(results, **constraints):
-    """Get sum of result counts that meet constraints."""
-    count = 0
-    for result in results:
-        if all(
-            OP_MAP[constraint["operator"]](
-                result.get(feature, None),
-                constraint.get("value", constraint.get("values")),
-            )
-            for feature, constraint in constraints.items()
-        ):
-            count += result["count"]
-    return count
+def qualifier_masks(qualifiers, levels) -> np.ndarray:
+    """Compile feature qualifiers into a qualifier-by-level 0/1 matrix."""
+    return np.array([
+        [columnar.qualifier_holds(level, qualifier) for level in levels]
+        for qualifier in qualifiers
+    ], dtype=np.int64).reshape(len(qualifiers), len(levels))
+
 
+def dense_counts(counts):
+    """Convert count_unique rows into levels and a dense count table."""
+    levels_a = list(dict.fromkeys(row[0] for row in counts))
+    levels_b = list(dict.fromkeys(row[1] for row in counts))
+    index_a = {level: i for i, level in enumerate(levels_a)}
+    index_b = {level: i for i, level in enumerate(levels_b)}
+    table_ = np.zeros((len(levels_a), len(levels_b)), dtype=np.int64)
+    for a, b, count in counts:
+        table_[index_a[a], index_b[b]] += count
+    return levels_a, levels_b, table_
 
-REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
-r = redis.Redis(host=REDIS_HOST)
 
+def count_unique_key(conn, table_name, cohort_features, *columns):
+    """Get cache key of count_unique.
+
+    count_unique ignores feature years, so the key does too.
+    """
+    return cache.key(
+        "count_unique",
+        table_name,
+        None,
+        [
+            {key: value for key, value in feature.items() if key != "year"}
+            for feature in cohort_feature_list(cohort_features)
+        ],
+        *columns,
+    )
 
-def cached(key=lambda *args: hash(tuple(args))):
-    """Generate a decorator to cache results."""
-    def decorator(func):
-        """Decorate a function to cache results."""
-        @wraps(func)
-        def wrapper(*args):
-            key_ = key(*args)
-            cached_result = r.get(key_)
-            if cached_result is not None:
-                return json.loads(cached_result)
-            result = func(*args)
-            r.set(key_, json.dumps(result))
-            return result
-        return wrapper
-    return decorator
 
+def cohort_table(table_name, cohort_features, columns):
+    """Get table clause with columns and cohort feature columns."""
+    return table(table_name, *(
+        column(name)
+        for name in dict.fromkeys(chain(
+            columns,
+            (feature["feature_name"] for feature in cohort_features),
+        ))
+    ))
 
-@cached(key=lambda db, *args: json.dumps(args))
-def count_unique(conn, table_name, *columns):
-    """Count each unique combination of column values.
+
+def filter_cohort(s, cohort_features, table_):
+    """Add WHERE clauses for cohort features to selection."""
+    for feature in cohort_features:
+        s = filter_select(
+            s,
+            feature["feature_name"],
+            feature["feature_qualifier"],
+            table_,
+        )
+    return s
+
+
+@cached(key=count_unique_key)
+def count_unique(conn, table_name, cohort_features, *columns):
+    """Count each unique combination of column values, within the cohort.
+
+    The cohort features filter the rows of the table through bound
+    parameters, so no temporary view is needed.
 
     For example, for columns = ["a", "b"] and data
     a  b  c  d
@@ -505,14 +709,184 @@ def count_unique(conn, table_name, *columns):
         [2, 2, 1]
     ]
     """
+    table_ = cohort_table(table_name, cohort_features, columns)
+    columns = [table_.c[name] for name in columns]
+    s = select([
+        *(col.label(f"{i}_{col.name}") for i, col in enumerate(columns)),
+        func.count(),
+    ]).select_from(table_)
+    s = filter_cohort(s, cohort_features, table_)
     return [list(row) for row in conn.execute(
-        "SELECT {cols}, count(*) FROM {table_name} GROUP BY {cols}".format(
-            cols=", ".join(f"\"{col}\"" for col in columns),
-            table_name=table_name,
-        )
+        s.group_by(*columns)
     ).fetchall()]
 
 
+# SQLite's default SQLITE_MAX_COMPOUND_SELECT
+UNION_LIMIT = 500
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER, before 3.32
+VARIABLE_LIMIT = 999
+
+
+def count_unique_grouping_sets(conn, table_name, cohort_features, pairs):
+    """Count unique pairs of column values in one scan, using GROUPING SETS."""
+    names = list(dict.fromkeys(chain.from_iterable(pairs)))
+    table_ = cohort_table(table_name, cohort_features, names)
+    columns = [table_.c[name] for name in names]
+    grouping_sets = list(dict.fromkeys(
+        tuple(name for name in names if name in pair)
+        for pair in pairs
+    ))
+    s = select([
+        *columns,
+        func.count(),
+        *(func.grouping(col) for col in columns),
+    ]).select_from(table_)
+    s = filter_cohort(s, cohort_features, table_)
+    s = s.group_by(func.grouping_sets(*(
+        tuple_(*(table_.c[name] for name in grouping_set))
+        for grouping_set in grouping_sets
+    )))
+    results = {grouping_set: [] for grouping_set in grouping_sets}
+    for row in conn.execute(s):
+        values = dict(zip(names, row[:len(names)]))
+        grouping_set = tuple(
+            name
+            for name, grouping in zip(names, row[len(names) + 1:])
+            if grouping == 0
+        )
+        results[grouping_set].append((values, row[len(names)]))
+    return {
+        (ka, kb): [
+            [values[ka], values[kb], count]
+            for values, count in results[tuple(
+                name for name in names if name in (ka, kb)
+            )]
+        ]
+        for ka, kb in pairs
+    }
+
+
+def count_unique_union_all(conn, table_name, cohort_features, pairs):
+    """Count unique pairs of column values in one query, using UNION ALL.
+
+    Pairs are counted in chunks small enough for SQLite's limits on
+    compound selects and bound parameters. Only the cohort filter binds
+    parameters; pair indices are rendered inline.
+    """
+    names = list(dict.fromkeys(chain.from_iterable(pairs)))
+    table_ = cohort_table(table_name, cohort_features, names)
+    selects = [
+        filter_cohort(
+            select([
+                literal_column(str(index)).label("pair"),
+                table_.c[ka].label("a"),
+                table_.c[kb].label("b"),
+                func.count().label("count"),
+            ]).select_from(table_),
+            cohort_features,
+            table_,
+        ).group_by(table_.c[ka], table_.c[kb])
+        for index, (ka, kb) in enumerate(pairs)
+    ]
+    parameters = len(selects[0].compile().params)
+    chunk_size = min(UNION_LIMIT, max(1, VARIABLE_LIMIT // max(1, parameters)))
+    results = {pair: [] for pair in pairs}
+    for start in range(0, len(selects), chunk_size):
+        chunk = selects[start:start + chunk_size]
+        s = chunk[0] if len(chunk) == 1 else union_all(*chunk)
+        for index, a, b, count in conn.execute(s):
+            results[pairs[index]].append([a, b, count])
+    return results
+
+
+def count_unique_pairs(conn, table_name, cohort_features, pairs):
+    """Count each unique combination of values, for many column pairs.
+
+    The result maps each (column a, column b) pair to what
+    count_unique(conn, table_name, cohort_features, a, b) would return, and
+    shares its cache. Uncached pairs are counted together, in one scan with
+    GROUPING SETS on postgres and in one UNION ALL query on sqlite.
+    """
+    results = {}
+    missing = []
+    for pair in dict.fromkeys(pairs):
+        cached_result = cache.load(count_unique_key(conn, table_name, cohort_features, *pair))
+        if cached_result is None:
+            missing.append(pair)
+        else:
+            results[pair] = cached_result
+    if not missing:
+        return results
+    if os.environ.get("ICEES_DB", "sqlite") == "sqlite":
+        counted = count_unique_union_all(conn, table_name, cohort_features, missing)
+    else:
+        counted = count_unique_grouping_sets(conn, table_name, cohort_features, missing)
+    for pair, result in counted.items():
+        result = [list(row) for row in result]
+        cache.store(
+            count_unique_key(conn, table_name, cohort_features, *pair),
+            result,
+        )
+        results[pair] = result
+    return results
+
+
+def cohort_feature_list(cohort_features):
+    """Convert cohort features from dict form to list form."""
+    if isinstance(cohort_features, list):
+        return cohort_features
+    return [
+        {
+            "feature_name": key,
+            "feature_qualifier": value,
+        }
+        for key, value in cohort_features.items()
+    ]
+
+
+def count_feature_pairs(conn, table_name, cohort_features, pairs):
+    """Count each unique combination of values, for many feature pairs.
+
+    Counts come from the population cube when there are no cohort features,
+    from the columnar engine when it is loaded, and from the database
+    otherwise.
+    """
+    cohort_features = cohort_feature_list(cohort_features)
+    population_cube = None
+    if not cohort_features:
+        population_cube = cube.get_cube(table_name)
+    if population_cube is not None and all(
+            ka in population_cube and kb in population_cube
+            for ka, kb in pairs
+    ):
+        return {
+            (ka, kb): population_cube.count_unique(ka, kb)
+            for ka, kb in pairs
+        }
+    columnar_table = columnar.get_table(table_name)
+    if columnar_table is not None:
+        mask = columnar_table.mask(cohort_features)
+        return {
+            (ka, kb): columnar_table.count_unique(ka, kb, mask=mask)
+            for ka, kb in pairs
+        }
+    return count_unique_pairs(conn, table_name, cohort_features, pairs)
+
+
+def association_digest(table_name, year, cohort_features, cohort_year, feature_a, feature_b):
+    """Get the association cache digest of a feature matrix."""
+    cohort_features = cohort_feature_list(cohort_features)
+    if cohort_features:
+        cohort_year = None
+    return association_cache.digest(
+        table_name,
+        cohort_features,
+        cohort_year,
+        normalize_feature(year, feature_a),
+        normalize_feature(year, feature_b),
+    )
+
+
 def select_feature_matrix(
         conn,
         table_name,
@@ -521,37 +895,16 @@ def select_feature_matrix(
         cohort_year,
         feature_a,
         feature_b,
+        counts=None,
+        statistics=True,
 ):
-    """Select feature matrix."""
-    if not isinstance(cohort_features, list):
-        cohort_features = [
-            {
-                "feature_name": key,
-                "feature_qualifier": {
-                    "operator": value["operator"],
-                    "value": value["value"],
-                },
-            }
-            for key, value in cohort_features.items()
-        ]
-    if cohort_features:
-        view_query = (
-            "CREATE VIEW tmp AS "
-            "SELECT * FROM {} "
-            "WHERE {}"
-        ).format(
-            table_name,
-            " AND ".join(
-                "\"{}\" {} {}".format(
-                    feature["feature_name"],
-                    feature["feature_qualifier"]["operator"],
-                    feature["feature_qualifier"]["value"],
-                )
-                for feature in cohort_features
-            )
-        )
-        conn.execute(view_query)
-        table_name = "tmp"
+    """Select feature matrix.
+
+    counts, if given, holds the count_unique result for the two features,
+    e.g. from count_feature_pairs. If statistics is False, the chi-squared
+    statistic and p-value are left to set_chi_squared.
+    """
+    cohort_features = cohort_feature_list(cohort_features)
 
     start_time = time.time()
     cohort_features_norm = normalize_features(cohort_year, cohort_features)
@@ -559,42 +912,16 @@ def select_feature_matrix(
     feature_b_norm = normalize_feature(year, feature_b)
     print(f"{time.time() - start_time} seconds spent normalizing")
 
-    # start_time = time.time()
-    # cohort_features_json = json.dumps(cohort_features_norm, sort_keys=True)
-    # feature_a_json = json.dumps(feature_a_norm, sort_keys=True)
-    # feature_b_json = json.dumps(feature_b_norm, sort_keys=True)
-    # print(f"{time.time() - start_time} seconds spent json.dumping")
-
     cohort_year = cohort_year if len(cohort_features_norm) == 0 else None
 
-    # start_time = time.time()
-    # digest = get_digest(
-    #     json.dumps(table_name),
-    #     cohort_features_json,
-    #     json.dumps(cohort_year),
-    #     feature_a_json,
-    #     feature_b_json,
-    # )
-    # print(f"{time.time() - start_time} seconds spent getting digest")
-
-    # start_time = time.time()
-    # result = conn.execute(
-    #     select([cache.c.association])\
-    #     .select_from(cache)\
-    #     .where(cache.c.digest == digest)\
-    #     .where(cache.c.table == table_name)\
-    #     .where(cache.c.cohort_features == cohort_features_json)\
-    #     .where(cache.c.cohort_year == cohort_year)\
-    #     .where(cache.c.feature_a == feature_a_json)\
-    #     .where(cache.c.feature_b == feature_b_json)
-    # ).first()
-    # print(f"{time.time() - start_time} seconds spent checking cache")
-    # if result is None:
-    #     print("cache miss...")
-    # else:
-    #     print("cache hit!")
-
-    # timestamp = datetime.now(timezone.utc)
+    digest = None
+    if association_cache.ASSOCIATION_CACHE and statistics:
+        digest = association_digest(
+            table_name, year, cohort_features, cohort_year, feature_a, feature_b,
+        )
+        association = association_cache.lookup(conn, digest)
+        if association is not None:
+            return association
 
     ka = feature_a_norm["feature_name"]
     vas = feature_a_norm["feature_qualifiers"]
@@ -604,43 +931,20 @@ def select_feature_matrix(
     yb = feature_b_norm["year"]
 
     start_time = time.time()
-    result = count_unique(conn, table_name, ka, kb)
-    _ka = "0_" + ka
-    _kb = "1_" + kb
-    result = [
-        {
-            _ka: el[0],
-            _kb: el[1],
-            "count": el[2],
-        }
-        for el in result
-    ]
+    if counts is None:
+        counts = count_feature_pairs(
+            conn, table_name, cohort_features, [(ka, kb)],
+        )[ka, kb]
     print(f"{time.time() - start_time} seconds spent doing it the fast way")
 
-    feature_matrix = [
-        [
-            get_count(result, **{
-                _ka: va,
-                _kb: vb,
-            })
-            for va in vas
-        ]
-        for vb in vbs
-    ]
-
-    total_cols = [
-        get_count(result, **{_ka: va}) for va in vas
-    ]
-    total_rows = [
-        get_count(result, **{_kb: vb}) for vb in vbs
-    ]
+    levels_a, levels_b, counts = dense_counts(counts)
+    mask_a = qualifier_masks(vas, levels_a)
+    mask_b = qualifier_masks(vbs, levels_b)
 
-    total = get_count(result)
-
-    observed = list(map(
-        lambda x: list(map(add_eps, x)),
-        feature_matrix
-    ))
+    feature_matrix = (mask_b @ counts.T @ mask_a.T).tolist()
+    total_cols = (mask_a @ counts.sum(axis=1)).tolist()
+    total_rows = (mask_b @ counts.sum(axis=0)).tolist()
+    total = int(counts.sum())
 
     feature_matrix2 = [
         [
@@ -662,53 +966,31 @@ def select_feature_matrix(
         **feature_b_norm,
         "biolink_class": mappings.get(kb)["categories"][0]
     }
-    if observed:
-        start_time = time.time()
-        chi_squared, p, *_ = chi2_contingency(observed, correction=False)
-        print(f"{time.time() - start_time} seconds spent on chi2 contingency")
-
-        association = {
-            "feature_a": feature_a_norm_with_biolink_class,
-            "feature_b": feature_b_norm_with_biolink_class,
-            "feature_matrix": feature_matrix2,
-            "rows": [
-                {"frequency": a, "percentage": b}
-                for (a,b) in zip(total_rows, map(lambda x: div(x, total), total_rows))
-            ],
-            "columns": [
-                {"frequency": a, "percentage": b}
-                for (a,b) in zip(total_cols, map(lambda x: div(x, total), total_cols))
-            ],
-            "total": total,
-            "p_value": p,
-            "chi_squared": chi_squared
-        }
-    else:
-        association = {
-            "feature_a": feature_a_norm_with_biolink_class,
-            "feature_b": feature_b_norm_with_biolink_class,
-            "feature_matrix": feature_matrix2,
-            "rows": [
-                {"frequency": a, "percentage": b}
-                for (a,b) in zip(total_rows, map(lambda x: div(x, total), total_rows))
-            ],
-            "columns": [
-                {"frequency": a, "percentage": b}
-                for (a,b) in zip(total_cols, map(lambda x: div(x, total), total_cols))
-            ],
-            "total": total,
-            "p_value": None,
-            "chi_squared": None
-        }
-
-    # association_json = json.dumps(association, sort_keys=True)
 
-    if cohort_features:
-        conn.execute("DROP VIEW tmp")
+    association = {
+        "feature_a": feature_a_norm_with_biolink_class,
+        "feature_b": feature_b_norm_with_biolink_class,
+        "feature_matrix": feature_matrix2,
+        "rows": [
+            {"frequency": a, "percentage": b}
+            for (a,b) in zip(total_rows, map(lambda x: div(x, total), total_rows))
+        ],
+        "columns": [
+            {"frequency": a, "percentage": b}
+            for (a,b) in zip(total_cols, map(lambda x: div(x, total), total_cols))
+        ],
+        "total": total,
+        "p_value": None,
+        "chi_squared": None
+    }
+    if statistics:
+        set_chi_squared([association])
 
-    # start_time = time.time()
-    # conn.execute(cache.insert().values(digest=digest, association=association_json, table=table_name, cohort_features=cohort_features_json, feature_a=feature_a_json, feature_b=feature_b_json, access_time=timestamp))
-    # print(f"{time.time() - start_time} seconds spent writing to cache")
+    if digest is not None:
+        association_cache.store(
+            conn, digest, table_name, cohort_features, cohort_year,
+            feature_a_norm, feature_b_norm, association,
+        )
 
     return association
 
@@ -720,7 +1002,7 @@ def select_feature_count_all_values(
         cohort_features,
         cohort_year,
         feature_name,
-        levels
+        levels,
 ):
     """Select feature count."""
     cohort_features_norm = normalize_features(cohort_year, cohort_features)
@@ -737,14 +1019,98 @@ def select_feature_count_all_values(
     sqlcolumn = column(feature_name)
 
     result = conn.execute(select([sqlcolumn, func.count()]).select_from(table).group_by(sqlcolumn)).fetchall()
-    
-    values = defaultdict(int)
 
-    
-    for value, count in result:
-        values[value] = count
+    return feature_count_all_values(feature_name, year, levels, dict(result))
+
+
+def select_cohort_profile(
+        conn,
+        table_name,
+        year,
+        cohort_features,
+        cohort_year,
+        feature_names,
+):
+    """Count the values of every feature over the cohort, in one pass.
+
+    The result maps each feature name to a {value: count} dict, counting
+    the same rows as select_feature_count_all_values.
+    """
+    cohort_features_norm = normalize_features(cohort_year, cohort_features)
+
+    cohort_year = cohort_year if len(cohort_features_norm) == 0 else None
+
+    if not feature_names:
+        return {}
+
+    columnar_table = columnar.get_table(table_name)
+    if columnar_table is not None:
+        counts = columnar_table.index.profile(
+            feature_names, cohort_features_norm, cohort_year, year,
+        )
+        return {
+            feature_name: {
+                level: int(count)
+                for level, count in zip(
+                    columnar_table.column(feature_name).levels,
+                    counts[feature_name],
+                )
+                if count
+            }
+            for feature_name in feature_names
+        }
+
+    table, _ = generate_tables_from_features(
+        table_name,
+        cohort_features_norm,
+        cohort_year,
+        [(feature_name, year) for feature_name in feature_names],
+    )
 
-    total = sum(values.values())    
+    sqlcolumns = [column(feature_name) for feature_name in feature_names]
+    profile = {feature_name: defaultdict(int) for feature_name in feature_names}
+
+    if os.environ.get("ICEES_DB", "sqlite") == "sqlite":
+        # one UNION ALL of per-feature GROUP BYs over the cohort rows, which
+        # are selected once, in a CTE, so the cohort parameters are bound once
+        cohort_rows = select(sqlcolumns).select_from(table).cte("cohort_rows")
+        selects = [
+            select([
+                literal_column(str(index)).label("feature"),
+                cohort_rows.c[feature_name].label("value"),
+                func.count().label("count"),
+            ]).group_by(cohort_rows.c[feature_name])
+            for index, feature_name in enumerate(feature_names)
+        ]
+        for start in range(0, len(selects), UNION_LIMIT):
+            chunk = selects[start:start + UNION_LIMIT]
+            s = chunk[0] if len(chunk) == 1 else union_all(*chunk)
+            for index, value, count in conn.execute(s):
+                profile[feature_names[index]][value] += count
+    else:
+        result = conn.execute(
+            select([
+                *sqlcolumns,
+                func.count(),
+                *(func.grouping(sqlcolumn) for sqlcolumn in sqlcolumns),
+            ]).select_from(table).group_by(func.grouping_sets(*sqlcolumns))
+        )
+        n = len(sqlcolumns)
+        for row in result:
+            i = list(row[n + 1:]).index(0)
+            profile[feature_names[i]][row[i]] += row[n]
+
+    return {
+        feature_name: dict(values)
+        for feature_name, values in profile.items()
+    }
+
+
+def feature_count_all_values(feature_name, year, levels, counts):
+    """Build feature count from {value: count} dict."""
+    values = defaultdict(int, counts)
+
+    total = sum(values.values())
 
     levels = list(levels)
     for value in values.keys():
@@ -780,18 +1146,43 @@ def get_feature_levels(feature):
     return value_sets.get(feature, [])
 
 
-def apply_correction(ret, correction=None):
-    """Apply p-value correction."""
+def set_chi_squared(associations):
+    """Set chi-squared statistics and p-values of associations, in one batch."""
+    chi_squared, p_values = stats.chi2_batch([
+        np.array([
+            [add_eps(cell["frequency"]) for cell in row]
+            for row in association["feature_matrix"]
+        ])
+        for association in associations
+    ])
+    for association, chi_squared_, p_value in zip(associations, chi_squared, p_values):
+        association["chi_squared"] = chi_squared_
+        association["p_value"] = p_value
+    return associations
+
+
+def apply_correction(associations, correction=None):
+    """Apply p-value correction over a family of associations."""
     if correction is not None:
-        method = correction["method"]
-        alpha = correction.get("alpha", 1)
-        if ret["p_value"] is None:
-            ret["p_value_corrected"] = None
-            return
-        rsp = [ret["p_value"]]
-        _, pvals, _, _ = multipletests(rsp, alpha, method)
-        ret["p_value_corrected"] = pvals[0]
-    return ret
+        corrected = stats.correct(
+            [association["p_value"] for association in associations],
+            correction["method"],
+            correction.get("alpha", 1),
+        )
+        for association, p_value in zip(associations, corrected):
+            association["p_value_corrected"] = p_value
+    return associations
+
+
+def filter_p_value(associations, maximum_p_value):
+    """Keep associations with (corrected) p-value at most maximum_p_value."""
+    return [
+        association
+        for association in associations
+        if (pval := association.get(
+            "p_value_corrected", association.get("p_value", None)
+        )) is not None and pval <= maximum_p_value
+    ]
 
 
 class PValueError(Exception):
@@ -808,85 +1199,196 @@ def select_feature_association(
         maximum_p_value,
         feature_b,
         correction,
+        counts=None,
 ):
     """Select feature association."""
-    ret = apply_correction(
+    ret, = apply_correction([
         select_feature_matrix(
             conn, table_name, year,
-            cohort_features, cohort_year, feature_a, feature_b,
+            cohort_features, cohort_year, feature_a, feature_b, counts,
         ),
-        correction,
-    )
-    if (pval := ret.get("p_value_corrected", ret.get("p_value", None))) is None or pval > maximum_p_value:
+    ], correction)
+    if not filter_p_value([ret], maximum_p_value):
+        pval = ret.get("p_value_corrected", ret.get("p_value", None))
         raise PValueError(f"p-value {pval} > {maximum_p_value}")
     return ret
 
 
-def select_associations_to_all_features(
-        conn,
-        table,
-        year,
-        cohort_id,
-        feature_filter_a: Union[Callable[[str], bool], Dict[str, Any]],
-        maximum_p_value,
-        feature_filter_b: Callable[[str], bool] = lambda x: True,
-        correction=None,
-):
-    cohort_meta = get_features_by_id(conn, table, cohort_id)
-    if cohort_meta is None:
-        raise ValueError("Input cohort_id invalid. Please try again.")
+# feature pairs counted per batch when streaming associations
+STREAM_CHUNK_SIZE = 50
 
-    cohort_features, cohort_year = cohort_meta
 
+def level_feature(feature_name):
+    """Get feature with one qualifier per level."""
+    return {
+        "feature_name": feature_name,
+        "feature_qualifiers": list(map(
+            lambda level: {"operator": "=", "value": level},
+            get_feature_levels(feature_name),
+        ))
+    }
+
+
+def all_features_pairs(conn, table, feature_filter_a, feature_filter_b):
+    """Get distinct pairs of features."""
     if isinstance(feature_filter_a, Callable):
         feature_as = [
-            {
-                "feature_name": feature_name,
-                "feature_qualifiers": list(map(
-                    lambda level: {"operator": "=", "value": level},
-                    get_feature_levels(feature_name),
-                ))
-            }
+            level_feature(feature_name)
             for feature_name in filter(feature_filter_a, get_features(conn, table))
         ]
     else:
         feature_as = [feature_filter_a]
 
     feature_bs = [
-        {
-            "feature_name": feature_name,
-            "feature_qualifiers": list(map(
-                lambda level: {"operator": "=", "value": level},
-                get_feature_levels(feature_name),
-            ))
-        }
+        level_feature(feature_name)
         for feature_name in filter(feature_filter_b, get_features(conn, table))
     ]
 
-    associations = []
+    pairs = []
     done = set()
     for feature_a, feature_b in product(feature_as, feature_bs):
         hashable = tuple(sorted((feature_a["feature_name"], feature_b["feature_name"])))
         if hashable in done:
             continue
         done.add(hashable)
-        try:
-            associations.append(select_feature_association(
-                conn,
-                table,
-                year,
-                cohort_features,
-                cohort_year,
-                feature_a,
-                maximum_p_value,
-                feature_b,
-                correction,
-            ))
-        except PValueError:
-            continue
+        pairs.append((feature_a, feature_b))
+    return pairs
+
+
+def select_associations(conn, table, year, cohort_features, cohort_year, pairs):
+    """Select associations of feature pairs, with uncorrected statistics.
+
+    Counts of the pairs are taken in one batch, and associations are
+    served from and stored in the association cache, if enabled.
+    """
+    associations = [None] * len(pairs)
+    digests = [None] * len(pairs)
+    if association_cache.ASSOCIATION_CACHE:
+        digests = [
+            association_digest(
+                table, year, cohort_features, cohort_year, feature_a, feature_b,
+            )
+            for feature_a, feature_b in pairs
+        ]
+        cached_associations = association_cache.lookup_many(conn, digests)
+        associations = [cached_associations.get(digest) for digest in digests]
+    missing = [i for i, association in enumerate(associations) if association is None]
+
+    counts = count_feature_pairs(conn, table, cohort_features, [
+        (pairs[i][0]["feature_name"], pairs[i][1]["feature_name"])
+        for i in missing
+    ]) if missing else {}
+    computed = set_chi_squared([
+        select_feature_matrix(
+            conn,
+            table,
+            year,
+            cohort_features,
+            cohort_year,
+            pairs[i][0],
+            pairs[i][1],
+            counts[pairs[i][0]["feature_name"], pairs[i][1]["feature_name"]],
+            statistics=False,
+        )
+        for i in missing
+    ])
+    for i, association in zip(missing, computed):
+        associations[i] = association
+        if digests[i] is not None:
+            association_cache.store(
+                conn, digests[i], table,
+                cohort_feature_list(cohort_features),
+                cohort_year if not cohort_features else None,
+                normalize_feature(year, pairs[i][0]),
+                normalize_feature(year, pairs[i][1]),
+                association,
+            )
     return associations
 
 
+def iter_associations_to_all_features(
+        conn,
+        table,
+        year,
+        cohort_id,
+        feature_filter_a: Union[Callable[[str], bool], Dict[str, Any]],
+        maximum_p_value,
+        feature_filter_b: Callable[[str], bool] = lambda x: True,
+        correction=None,
+        chunk_size: Optional[int] = None,
+        own_connection: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """Generate associations to all features as they are computed.
+
+    The cohort is checked before generation starts. Without correction,
+    pairs are computed chunk_size (default STREAM_CHUNK_SIZE, 0 for all) at
+    a time, and each association is generated as soon as it passes
+    maximum_p_value; correction needs the p-values of the whole family, so
+    all pairs are computed first.
+
+    With own_connection, associations are computed on a connection opened
+    from the engine of conn when generation starts, and closed when it
+    ends, so that they can be generated after conn is closed, e.g. while a
+    response is streamed.
+    """
+    cohort_meta = get_features_by_id(conn, table, cohort_id)
+    if cohort_meta is None:
+        raise ValueError("Input cohort_id invalid. Please try again.")
+
+    cohort_features, cohort_year = cohort_meta
+    pairs = all_features_pairs(conn, table, feature_filter_a, feature_filter_b)
+    if chunk_size is None:
+        chunk_size = STREAM_CHUNK_SIZE
+    if correction is not None or chunk_size == 0:
+        chunk_size = max(len(pairs), 1)
+
+    def generate(conn):
+        for start in range(0, len(pairs), chunk_size):
+            associations = select_associations(
+                conn, table, year, cohort_features, cohort_year,
+                pairs[start:start + chunk_size],
+            )
+            yield from filter_p_value(
+                apply_correction(associations, correction),
+                maximum_p_value,
+            )
+
+    def generate_on_own_connection(engine, tables):
+        connection = engine.connect()
+        try:
+            yield from generate(ConnectionWithTables(connection, tables))
+        finally:
+            connection.close()
+
+    if own_connection:
+        return generate_on_own_connection(conn.engine, conn.tables)
+    return generate(conn)
+
+
+def select_associations_to_all_features(
+        conn,
+        table,
+        year,
+        cohort_id,
+        feature_filter_a: Union[Callable[[str], bool], Dict[str, Any]],
+        maximum_p_value,
+        feature_filter_b: Callable[[str], bool] = lambda x: True,
+        correction=None,
+):
+    """Select associations to all features, counted in one batch."""
+    return list(iter_associations_to_all_features(
+        conn,
+        table,
+        year,
+        cohort_id,
+        feature_filter_a,
+        maximum_p_value,
+        feature_filter_b,
+        correction,
+        chunk_size=0,
+    ))
+
+
 def validate_range(conn, table_name, feature):
     feature_name = feature["feature_name"]
     values = feature["feature_qualifiers"]
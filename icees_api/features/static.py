@@ -0,0 +1,156 @@
+"""Static responses.
+
+Responses that only depend on config files are built once, at startup,
+serialized to bytes and served with an ETag. A response is rebuilt when
+the modification time of one of its files changes. Handlers return the
+StaticResponse, which prepare_output serves, with the terms and
+conditions, as is.
+"""
+from collections import defaultdict
+from hashlib import md5
+import json
+import logging
+import os
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+import yaml
+
+from .config import get_config_path
+
+logger = logging.getLogger(__name__)
+
+MAPPINGS_FILE = os.path.join(get_config_path(), "mappings.yml")
+BINS_FILE = "config/bins.json"
+
+
+class StaticResponse():
+    """Pre-serialized response."""
+
+    def __init__(self, value: Any):
+        """Initialize."""
+        self.value = value
+        self.body = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{md5(self.body).hexdigest()}"'
+        self.with_terms_: Optional[Tuple[str, "StaticResponse"]] = None
+
+    def with_terms(self, terms: str) -> "StaticResponse":
+        """Get response with terms and conditions, built on first use."""
+        if self.with_terms_ is None or self.with_terms_[0] != terms:
+            self.with_terms_ = (
+                terms,
+                StaticResponse({"terms and conditions": terms, **self.value}),
+            )
+        return self.with_terms_[1]
+
+
+def modification_times(paths: List[str]) -> Tuple[Optional[int], ...]:
+    """Get modification times of files, None for missing files."""
+    return tuple(
+        os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        for path in paths
+    )
+
+
+class Registry():
+    """Registry of static responses."""
+
+    def __init__(self):
+        """Initialize."""
+        self.builders: Dict[str, Tuple[Callable[[], Any], List[str]]] = {}
+        self.entries: Dict[str, Tuple[Tuple, StaticResponse]] = {}
+        self.lock = Lock()
+
+    def register(self, name: str, paths: List[str]):
+        """Generate a decorator registering a builder of a response from files."""
+        def decorator(build):
+            """Register builder."""
+            self.builders[name] = (build, paths)
+            return build
+        return decorator
+
+    def get(self, name: str) -> StaticResponse:
+        """Get response, rebuilding it if its files have changed."""
+        build, paths = self.builders[name]
+        mtimes = modification_times(paths)
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == mtimes:
+            return entry[1]
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != mtimes:
+                entry = (mtimes, StaticResponse(build()))
+                self.entries[name] = entry
+        return entry[1]
+
+    def build_all(self):
+        """Build all responses; failures are logged and retried on use."""
+        for name in self.builders:
+            try:
+                self.get(name)
+            except Exception as err:
+                logger.warning(f"failed to build static response {name}: {err}")
+
+
+registry = Registry()
+
+
+def respond(static_response: StaticResponse, request: Request) -> Response:
+    """Serve static response, or 304 if the client has it."""
+    headers = {"ETag": static_response.etag}
+    if request.headers.get("if-none-match") == static_response.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(
+        static_response.body,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def meta_knowledge_graph_from_mappings(mappings: Dict) -> Dict:
+    """Build meta-knowledge graph of feature mappings."""
+    all_categories = set()
+    id_prefixes = defaultdict(set)
+    for feature in mappings:
+        categories = mappings[feature]["categories"]
+        all_categories.update(categories)
+        identifiers = mappings[feature].get("identifiers", [])
+        for category in categories:
+            for identifier in identifiers:
+                id_prefixes[category].add(identifier.split(":")[0])
+    all_categories = sorted(all_categories)
+    return {
+        "nodes": {
+            category: {"id_prefixes": sorted(prefixes)}
+            for category, prefixes in id_prefixes.items()
+        },
+        "edges": [
+            {
+                "subject": sub,
+                "object": obj,
+                "predicate": predicate,
+            }
+            for predicate in (
+                "biolink:correlated_with",
+                "biolink:has_real_world_evidence_of_association_with",
+            )
+            for sub in all_categories for obj in all_categories
+        ],
+    }
+
+
+@registry.register("meta_knowledge_graph", [MAPPINGS_FILE])
+def meta_knowledge_graph() -> Dict:
+    """Build meta-knowledge graph."""
+    with open(MAPPINGS_FILE, "r") as stream:
+        mappings = yaml.load(stream, Loader=yaml.SafeLoader)
+    return meta_knowledge_graph_from_mappings(mappings)
+
+
+@registry.register("bins", [BINS_FILE])
+def bins() -> Dict:
+    """Read bin values."""
+    with open(BINS_FILE, "r") as stream:
+        return json.load(stream)
@@ -0,0 +1,63 @@
+"""Batched association statistics.
+
+Exploratory requests produce a family of contingency tables. Tables of the
+same shape are stacked and their chi-squared statistics computed together,
+and multiple-testing correction is applied once over the whole family.
+"""
+from collections import defaultdict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.stats import chi2
+from statsmodels.stats.multitest import multipletests
+
+
+def chi2_batch(
+        tables: Sequence[np.ndarray],
+) -> Tuple[List[Optional[float]], List[Optional[float]]]:
+    """Compute chi-squared statistics and p-values of contingency tables.
+
+    This agrees with scipy.stats.chi2_contingency(table, correction=False)
+    for each table: tables with no degrees of freedom get statistic 0 and
+    p-value 1. Empty tables get None for both.
+    """
+    statistics: List[Optional[float]] = [None] * len(tables)
+    p_values: List[Optional[float]] = [None] * len(tables)
+    shapes = defaultdict(list)
+    for i, table in enumerate(tables):
+        table = np.asarray(table, dtype=float)
+        if table.ndim == 2 and table.size:
+            shapes[table.shape].append(i)
+    for (n_rows, n_cols), indices in shapes.items():
+        observed = np.stack([np.asarray(tables[i], dtype=float) for i in indices])
+        dof = (n_rows - 1) * (n_cols - 1)
+        if dof == 0:
+            stat = np.zeros(len(indices))
+            p = np.ones(len(indices))
+        else:
+            total = observed.sum(axis=(1, 2), keepdims=True)
+            expected = (
+                observed.sum(axis=2, keepdims=True) *
+                observed.sum(axis=1, keepdims=True) /
+                total
+            )
+            stat = ((observed - expected) ** 2 / expected).sum(axis=(1, 2))
+            p = chi2.sf(stat, dof)
+        for i, stat_i, p_i in zip(indices, stat, p):
+            statistics[i] = float(stat_i)
+            p_values[i] = float(p_i)
+    return statistics, p_values
+
+
+def correct(p_values: Sequence[Optional[float]], method, alpha=1) -> List[Optional[float]]:
+    """Correct a family of p-values for multiple testing.
+
+    Missing (None) p-values are left out of the family and stay None.
+    """
+    indices = [i for i, p in enumerate(p_values) if p is not None]
+    corrected: List[Optional[float]] = [None] * len(p_values)
+    if indices:
+        _, pvals, _, _ = multipletests([p_values[i] for i in indices], alpha, method)
+        for i, p in zip(indices, pvals):
+            corrected[i] = float(p)
+    return corrected
@@ -0,0 +1,164 @@
+"""Cache warmup.
+
+Workers start with cold caches. The warmup replays popular requests through
+the code paths of the handlers, filling whichever caches are enabled:
+* the cohorts listed in warmup.yml in the config directory, with their
+  profiles and any feature associations listed with them;
+* the profiles of the ICEES_WARMUP_TOP_COHORTS cohorts most requested in
+  the request log.
+
+warmup.yml holds request bodies, as sent to the API:
+
+    - table: patient
+      cohort_features: {AsthmaDx: {operator: "=", value: 1}}
+      feature_association2:
+        - feature_a: {AgeStudyStart: [{operator: "=", value: "0-2"}, ...]}
+          feature_b: {...}
+      associations_to_all_features:
+        - feature: {AlcoholUse: {operator: "=", value: "Yes"}}
+          maximum_p_value: 1
+
+It runs at startup if ICEES_WARMUP is set, before the app accepts requests,
+and can be scheduled with
+    python -m icees_api.features.warmup
+"""
+import argparse
+from collections import Counter
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import time
+from typing import Dict, List, Tuple
+
+import yaml
+
+from ..db import DBConnection
+from ..dependencies import ConnectionWithTables
+from ..utils import to_qualifiers, to_qualifiers2
+from . import sql
+from .config import get_config_path
+
+logger = logging.getLogger(__name__)
+
+WARMUP = os.environ.get("ICEES_WARMUP", "false").lower() in ("1", "true", "yes")
+WARMUP_FILE = os.path.join(get_config_path(), "warmup.yml")
+TOP_COHORTS = int(os.environ.get("ICEES_WARMUP_TOP_COHORTS", "0"))
+LOG_PATH = os.environ.get("ICEES_API_LOG_PATH", "./logs")
+
+COHORT_PATH = re.compile(r"^/(?P<table>[^/]+)/cohort/(?P<cohort_id>[^/]+)(/|$)")
+
+
+def read_warmup_file(path=None) -> List[Dict]:
+    """Read warmup cohorts, if configured."""
+    path = Path(path or WARMUP_FILE)
+    if not path.exists():
+        return []
+    with open(path, "r") as stream:
+        return yaml.load(stream, Loader=yaml.SafeLoader) or []
+
+
+def top_cohorts(n: int, log_path=None) -> List[Tuple[str, str]]:
+    """Get the (table, cohort id)s most requested in the request logs."""
+    counts = Counter()
+    for log_file in sorted(Path(log_path or LOG_PATH).glob("server*")):
+        with open(log_file, "r") as stream:
+            for line in stream:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("event") != "request" or entry.get("response_status") != 200:
+                    continue
+                match = COHORT_PATH.match(entry.get("full_path", ""))
+                if match is not None:
+                    counts[match.group("table"), match.group("cohort_id")] += 1
+    return [cohort for cohort, _ in counts.most_common(n)]
+
+
+def warm_cohort(conn, table, cohort_id, requests: Dict = None) -> int:
+    """Warm the profile of a cohort, and associations requested on it.
+
+    Returns the number of results computed.
+    """
+    requests = requests or {}
+    cohort_meta = sql.get_features_by_id(conn, table, cohort_id)
+    if cohort_meta is None:
+        return 0
+    cohort_features, cohort_year = cohort_meta
+    sql.get_cohort_features(conn, table, None, cohort_features, cohort_year)
+    n = 1
+    for obj in requests.get("feature_association2", []):
+        sql.select_feature_matrix(
+            conn,
+            table,
+            None,
+            cohort_features,
+            cohort_year,
+            to_qualifiers2(obj["feature_a"]),
+            to_qualifiers2(obj["feature_b"]),
+        )
+        n += 1
+    for obj in requests.get("associations_to_all_features", []):
+        sql.select_associations_to_all_features(
+            conn,
+            table,
+            None,
+            cohort_id,
+            to_qualifiers(obj["feature"]),
+            obj.get("maximum_p_value", 1),
+            correction=obj.get("correction"),
+        )
+        n += 1
+    return n
+
+
+def run(conn, cohorts: List[Dict] = None, n_top: int = None, log_path=None) -> int:
+    """Warm caches.
+
+    Failures are logged and skipped. Returns the number of results computed.
+    """
+    if cohorts is None:
+        cohorts = read_warmup_file()
+    if n_top is None:
+        n_top = TOP_COHORTS
+    start_time = time.time()
+    n = 0
+    for cohort in cohorts:
+        try:
+            cohort_id, size = sql.get_ids_by_feature(
+                conn,
+                cohort["table"],
+                None,
+                cohort.get("cohort_features", {}),
+            )
+            if size == -1:
+                continue
+            n += warm_cohort(conn, cohort["table"], cohort_id, cohort)
+        except Exception as err:
+            logger.exception(f"failed to warm cohort {cohort}: {err}")
+    if n_top:
+        for table, cohort_id in top_cohorts(n_top, log_path):
+            try:
+                n += warm_cohort(conn, table, cohort_id)
+            except Exception as err:
+                logger.exception(f"failed to warm cohort {cohort_id}: {err}")
+    logger.info(f"{time.time() - start_time} seconds spent warming {n} results")
+    return n
+
+
+def main():
+    """Warm caches."""
+    parser = argparse.ArgumentParser(description="Warm caches.")
+    parser.add_argument("--file", default=WARMUP_FILE)
+    parser.add_argument("--top", type=int, default=TOP_COHORTS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with DBConnection() as conn:
+        run(ConnectionWithTables(conn), read_warmup_file(args.file), args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,19 @@
 """ICEES API handlers."""
 from collections import defaultdict
+from functools import partial
 import os
 import json
-from typing import Dict, Union
+from typing import Dict, Optional, Union
 
-from fastapi import APIRouter, Body, Depends, Security, HTTPException
+from fastapi import APIRouter, Body, Depends, Header, Security, HTTPException
 from fastapi.security.api_key import APIKeyQuery, APIKeyCookie, APIKeyHeader, APIKey
 from reasoner_pydantic import Query, Message
 from sqlalchemy.sql.expression import table
 from starlette.status import HTTP_403_FORBIDDEN
 
 from .dependencies import get_db
-from .features import knowledgegraph, sql
-from .features.identifiers import get_identifiers, input_dict
+from .features import cache, format_, knowledgegraph, sql, static
+from .features.identifiers import get_identifiers
 from .features.qgraph_utils import normalize_qgraph
 from .features.sql import validate_range
 from .features.mappings import mappings, correlations
@@ -31,6 +32,35 @@ COOKIE_DOMAIN = os.environ.get("COOKIE_DOMAIN")
 TABLES = ("patient", "visit")
 
 
+def select_associations_to_all_features(stream: bool, accept: Optional[str]):
+    """Get function selecting associations to all features.
+
+    If streaming is requested, associations are generated as they are
+    computed, and streamed as NDJSON. They are generated on a connection of
+    their own, as the connection of get_db may be closed before the
+    response is streamed.
+    """
+    if stream or format_.accepts(accept, format_.NDJSON):
+        return partial(sql.iter_associations_to_all_features, own_connection=True)
+    return sql.select_associations_to_all_features
+
+
+def format_associations(associations, compact: bool):
+    """Format association(s), in the compact format if requested.
+
+    The compact format holds the counts as flat arrays, with margins, and
+    leaves percentages to the client. Generated associations stay generated.
+    """
+    if not compact or isinstance(associations, str):
+        return associations
+    if isinstance(associations, dict):
+        return format_.format_compact(associations)
+    compacted = map(format_.format_compact, associations)
+    if isinstance(associations, list):
+        return list(compacted)
+    return compacted
+
+
 def validate_table(table_name):
     """Validate table name."""
     if table_name not in TABLES:
@@ -179,6 +209,7 @@ def feature_association(
             ...,
             example=FEATURE_ASSOCIATION_EXAMPLE,
         ),
+        compact: bool = False,
         conn=Depends(get_db),
         api_key: APIKey = Depends(get_api_key),
 ) -> Dict:
@@ -187,6 +218,9 @@ def feature_association(
     Users select a predefined cohort and two feature variables, and the service
     returns a 2 x 2 feature table with a correspondingChi Square statistic and
     P value.
+
+    With compact=true, each feature table holds its counts as flat arrays
+    with margins, leaving percentages to the client.
     """
     validate_table(table)
     feature_a = to_qualifiers(obj["feature_a"])
@@ -207,7 +241,7 @@ def feature_association(
             feature_a,
             feature_b,
         )
-    return {"return value": return_value}
+    return {"return value": format_associations(return_value, compact)}
 
 
 with open("examples/feature_association2.json") as stream:
@@ -225,6 +259,7 @@ def feature_association2(
             ...,
             example=FEATURE_ASSOCIATION2_EXAMPLE,
         ),
+        compact: bool = False,
         conn=Depends(get_db),
         api_key: APIKey = Depends(get_api_key),
 ) -> Dict:
@@ -233,6 +268,9 @@ def feature_association2(
     Users select a predefined cohort, two feature variables, and bins, which
     can be combined, and the service returns a N x N feature table with a
     corresponding Chi Square statistic and P value.
+
+    With compact=true, each feature table holds its counts as flat arrays
+    with margins, leaving percentages to the client.
     """
     validate_table(table)
     feature_a = to_qualifiers2(obj["feature_a"])
@@ -258,7 +296,7 @@ def feature_association2(
             feature_b,
         )
 
-    return {"return value": return_value}
+    return {"return value": format_associations(return_value, compact)}
 
 
 with open("examples/associations_to_all_features.json") as stream:
@@ -276,6 +314,9 @@ def associations_to_all_features(
             ...,
             example=ASSOCIATIONS_TO_ALL_FEATURES_EXAMPLE,
         ),
+        stream: bool = False,
+        compact: bool = False,
+        accept: Optional[str] = Header(None),
         conn=Depends(get_db),
         api_key: APIKey = Depends(get_api_key),
 ) -> Dict:
@@ -284,13 +325,20 @@ def associations_to_all_features(
     Users select a predefined cohort and a feature variable of interest, and
     the service returns a 1 x N feature table with corrected Chi Square
     statistics and associated P values.
+
+    With stream=true or "Accept: application/x-ndjson", associations are
+    streamed as NDJSON lines as they are computed, after a line with the
+    terms and conditions.
+
+    With compact=true, each feature table holds its counts as flat arrays
+    with margins, leaving percentages to the client.
     """
     validate_table(table)
     feature = to_qualifiers(obj["feature"])
     maximum_p_value = obj.get("maximum_p_value", 1)
     correction = obj.get("correction")
     print(feature)
-    return_value = sql.select_associations_to_all_features(
+    return_value = select_associations_to_all_features(stream, accept)(
         conn,
         table,
         None,
@@ -299,7 +347,7 @@ def associations_to_all_features(
         maximum_p_value,
         correction=correction,
     )
-    return {"return value": return_value}
+    return {"return value": format_associations(return_value, compact)}
 
 
 with open("examples/associations_to_all_features2.json") as stream:
@@ -317,6 +365,9 @@ def associations_to_all_features2(
             ...,
             example=ASSOCIATIONS_TO_ALL_FEATURES2_EXAMPLE,
         ),
+        stream: bool = False,
+        compact: bool = False,
+        accept: Optional[str] = Header(None),
         conn=Depends(get_db),
         api_key: APIKey = Depends(get_api_key),
 ) -> Dict:
@@ -325,6 +376,13 @@ def associations_to_all_features2(
     Users select a predefined cohort and a feature variable of interest and
     bins, which can be combined, and the service returns a 1 x N feature table
     with corrected Chi Square statistics and associated P values.
+
+    With stream=true or "Accept: application/x-ndjson", associations are
+    streamed as NDJSON lines as they are computed, after a line with the
+    terms and conditions.
+
+    With compact=true, each feature table holds its counts as flat arrays
+    with margins, leaving percentages to the client.
     """
     validate_table(table)
     feature = to_qualifiers2(obj["feature"])
@@ -333,7 +391,7 @@ def associations_to_all_features2(
         validate_range(conn, table, feature)
     maximum_p_value = obj["maximum_p_value"]
     correction = obj.get("correction")
-    return_value = sql.select_associations_to_all_features(
+    return_value = select_associations_to_all_features(stream, accept)(
         conn,
         table,
         None,
@@ -342,7 +400,7 @@ def associations_to_all_features2(
         maximum_p_value,
         correction=correction,
     )
-    return {"return value": return_value}
+    return {"return value": format_associations(return_value, compact)}
 
 
 @ROUTER.get(
@@ -486,40 +544,7 @@ def predicates(
         api_key: APIKey = Depends(get_api_key),
 ):
     """Get meta-knowledge graph."""
-    all_categories = set()
-    id_prefixes = defaultdict(set)
-    for feature in mappings:
-        categories = mappings[feature]["categories"]
-        all_categories.update(categories)
-        identifiers = input_dict["patient"][feature]
-        for category in categories:
-            for identifier in identifiers:
-                id_prefixes[category].add(identifier.split(":")[0])
-    id_prefixes = {
-        key: list(value)
-        for key, value in id_prefixes.items()
-    }
-    return {
-        "nodes": {
-            category: {"id_prefixes": prefixes}
-            for category, prefixes in id_prefixes.items()
-        },
-        "edges": [
-            {
-                "subject": sub,
-                "object": obj,
-                "predicate": "biolink:correlated_with",
-            }
-            for sub in all_categories for obj in all_categories
-        ] + [
-            {
-                "subject": sub,
-                "object": obj,
-                "predicate": "biolink:has_real_world_evidence_of_association_with",
-            }
-            for sub in all_categories for obj in all_categories
-        ],
-    }
+    return static.registry.get("meta_knowledge_graph")
 
 
 with open("examples/knowledge_graph_overlay.json") as stream:
@@ -754,8 +779,7 @@ def handle_bins(
         api_key: APIKey = Depends(get_api_key),
 ) -> Dict:
     """Return bin values."""
-    with open("config/bins.json", "r") as stream:
-        bins = json.load(stream)
+    bins = static.registry.get("bins").value
     if feature is not None:
         bins = {
             year_key: {
@@ -772,3 +796,31 @@ def handle_bins(
     if year is not None:
         bins = bins.get(year, None)
     return {"return_value": bins}
+
+
+@ROUTER.post(
+    "/admin/refresh_schema",
+    response_model=Dict,
+)
+def refresh_schema(
+        conn=Depends(get_db),
+        api_key: APIKey = Depends(get_api_key),
+) -> Dict:
+    """Re-reflect the database schema.
+
+    The schema is reflected once per process, so call this after changing
+    tables outside of the API. It refreshes the worker that serves it.
+    """
+    conn.refresh_tables()
+    return {"return value": sorted(conn.tables)}
+
+
+@ROUTER.get(
+    "/admin/cache",
+    response_model=Dict,
+)
+def cache_statistics(
+        api_key: APIKey = Depends(get_api_key),
+) -> Dict:
+    """Get cache hit/miss counters of the worker that serves it."""
+    return {"return value": cache.statistics()}
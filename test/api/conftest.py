@@ -0,0 +1,11 @@
+"""Test fixtures."""
+import pytest
+
+from icees_api.features import cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Cache in a fresh in-process tier only, never in a shared backend."""
+    monkeypatch.setattr(cache, "backend", cache.MemoryBackend())
+    monkeypatch.setattr(cache, "local", cache.LRUCache(2 ** 20))
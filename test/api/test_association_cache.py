@@ -0,0 +1,130 @@
+"""Test the persistent association cache."""
+from datetime import timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.sql import select
+
+from icees_api.features import association_cache, knowledgegraph, sql
+
+from .test_cohort import connect, data
+
+feature_a = {"feature_name": "AgeStudyStart", "feature_qualifiers": [
+    {"operator": "=", "value": "0-2"},
+    {"operator": "=", "value": "3-17"},
+]}
+feature_b = {"feature_name": "AsthmaDx", "feature_qualifiers": [
+    {"operator": "=", "value": 0},
+    {"operator": "=", "value": 1},
+]}
+
+
+def n_rows(conn):
+    """Count cached associations."""
+    return conn.execute(
+        select([func.count()]).select_from(association_cache.association_cache)
+    ).scalar()
+
+
+def test_store_and_lookup():
+    """Test that stored associations are found by digest."""
+    conn = connect(data)
+    digest = association_cache.digest("patient", [], 2010, feature_a, feature_b)
+    assert association_cache.lookup(conn, digest) is None
+    association_cache.store(
+        conn, digest, "patient", [], 2010, feature_a, feature_b, {"total": 13},
+    )
+    assert association_cache.lookup(conn, digest) == {"total": 13}
+    assert association_cache.digest("patient", [], 2011, feature_a, feature_b) != digest
+
+
+def test_lookup_many(monkeypatch):
+    """Test that digests are looked up, and accesses recorded, per chunk."""
+    monkeypatch.setattr(association_cache, "LOOKUP_CHUNK_SIZE", 4)
+    conn = connect(data)
+    digests = []
+    for year in range(2010, 2015):
+        digest = association_cache.digest("patient", [], year, feature_a, feature_b)
+        association_cache.store(
+            conn, digest, "patient", [], year, feature_a, feature_b, {"year": year},
+        )
+        digests.append(digest)
+    missing = association_cache.digest("patient", [], 2020, feature_a, feature_b)
+
+    statements = []
+    event.listen(
+        conn.engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement.split()[0]),
+    )
+    associations = association_cache.lookup_many(conn, [missing, *digests])
+    assert associations == {
+        digest: {"year": year}
+        for digest, year in zip(digests, range(2010, 2015))
+    }
+    assert statements == ["SELECT", "UPDATE", "SELECT", "UPDATE"]
+
+
+def test_evict_and_purge():
+    """Test that eviction keeps the most recently accessed associations."""
+    conn = connect(data)
+    digests = []
+    for year in range(2010, 2015):
+        digest = association_cache.digest("patient", [], year, feature_a, feature_b)
+        association_cache.store(
+            conn, digest, "patient", [], year, feature_a, feature_b, {"year": year},
+        )
+        digests.append(digest)
+    association_cache.lookup(conn, digests[0])
+
+    assert association_cache.evict(conn, max_rows=2) == 3
+    assert n_rows(conn) == 2
+    assert association_cache.lookup(conn, digests[0]) == {"year": 2010}
+    assert association_cache.lookup(conn, digests[1]) is None
+
+    assert association_cache.purge(conn, older_than=timedelta(days=1)) == 0
+    assert association_cache.purge(conn) == 2
+    assert n_rows(conn) == 0
+
+
+def test_feature_matrix_is_cached(monkeypatch):
+    """Test that feature matrices are computed once and then served from the cache."""
+    monkeypatch.setattr(association_cache, "ASSOCIATION_CACHE", True)
+    conn = connect(data)
+    cohort_id, _ = sql.select_cohort(conn, "patient", 2010, {})
+    association = sql.select_feature_matrix(
+        conn, "patient", 2010, {}, 2010, feature_a, feature_b,
+    )
+    associations = sql.select_associations_to_all_features(
+        conn, "patient", 2010, cohort_id, feature_a, 1,
+        lambda feature_name: feature_name in ("AsthmaDx", "Albuterol"),
+    )
+    assert len(associations) == 2
+    # the AsthmaDx matrix is shared with select_feature_matrix
+    assert n_rows(conn) == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError("association was recomputed")
+    monkeypatch.setattr(sql, "count_feature_pairs", fail)
+    monkeypatch.setattr(sql, "count_unique", fail)
+    assert sql.select_feature_matrix(
+        conn, "patient", 2010, {}, 2010, feature_a, feature_b,
+    ) == association
+    assert sql.select_associations_to_all_features(
+        conn, "patient", 2010, cohort_id, feature_a, 1,
+        lambda feature_name: feature_name in ("AsthmaDx", "Albuterol"),
+    ) == associations
+
+
+def test_co_occurrence_is_cached(monkeypatch):
+    """Test that knowledge-graph co-occurrences are served from the cache."""
+    monkeypatch.setattr(association_cache, "ASSOCIATION_CACHE", True)
+    conn = connect(data)
+    pairs = [("AgeStudyStart", "AsthmaDx"), ("Albuterol", "AsthmaDx")]
+    p_values = knowledgegraph.co_occurrence_feature_edges(conn, "patient", 2010, {}, pairs)
+    assert n_rows(conn) == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError("association was recomputed")
+    monkeypatch.setattr(sql, "count_feature_pairs", fail)
+    assert knowledgegraph.co_occurrence_feature_edges(
+        conn, "patient", 2010, {}, pairs,
+    ) == p_values
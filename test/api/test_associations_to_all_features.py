@@ -1,10 +1,15 @@
 """Test API."""
+import json
+
 from fastapi.testclient import TestClient
 import pytest
 
 from icees_api.app import APP
+from icees_api.features import format_, sql
+from icees_api.utils import to_qualifiers
 
 from ..util import load_data
+from .test_cohort import connect, data
 
 testclient = TestClient(APP)
 table = "patient"
@@ -237,3 +242,116 @@ def test_associations_to_all_features_with_correction_with_alpha():
     resp_json = resp.json()
     assert "return value" in resp_json
     assert isinstance(resp_json["return value"], list)
+
+
+@load_data(
+    APP,
+    """
+        PatientId,year,AgeStudyStart,Albuterol,AvgDailyPM2.5Exposure,EstResidentialDensity,AsthmaDx
+        varchar(255),int,varchar(255),varchar(255),int,int,int
+        1,2010,0-2,0,1,0,1
+        2,2010,0-2,1,1,0,0
+        3,2010,3-7,>1,1,0,0
+        4,2010,0-2,0,2,0,1
+        5,2010,3-7,1,2,0,1
+        6,2010,3-7,>1,2,0,1
+        7,2010,0-2,0,3,0,0
+        8,2010,0-2,1,3,0,0
+        9,2010,0-2,>1,3,0,0
+        10,2010,0-2,0,4,0,0
+        11,2010,0-2,1,4,0,0
+        12,2010,3-7,>1,4,0,1
+    """,
+    """
+        cohort_id,size,features,table,year
+        COHORT:1,12,"{}",patient,2010
+    """
+)
+@pytest.mark.parametrize("correction", [None, {"method": "bonferroni"}])
+def test_associations_to_all_features_stream(monkeypatch, correction):
+    """Test that streamed associations match the JSON response."""
+    monkeypatch.setattr(sql, "STREAM_CHUNK_SIZE", 2)
+    cohort_id = "COHORT:1"
+    atafdata = {
+        "feature": {
+            "feature_name": "AgeStudyStart",
+            "feature_qualifier": {
+                "operator": "=",
+                "value": "0-2"
+            }
+        },
+        "maximum_p_value": 1,
+        "correction": correction,
+    }
+    expected = testclient.post(
+        f"/{table}/cohort/{cohort_id}/associations_to_all_features",
+        json=atafdata,
+    ).json()["return value"]
+    assert len(expected) > 2
+
+    for kwargs in (
+            {"params": {"stream": True}},
+            {"headers": {"Accept": "application/x-ndjson"}},
+            {"headers": {"Accept": "application/x-ndjson, */*;q=0.8"}},
+    ):
+        resp = testclient.post(
+            f"/{table}/cohort/{cohort_id}/associations_to_all_features",
+            json=atafdata,
+            **kwargs,
+        )
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        assert "terms and conditions" in lines[0]
+        assert lines[1:] == expected
+
+    resp = testclient.post(
+        f"/{table}/cohort/{cohort_id}/associations_to_all_features",
+        params={"stream": True, "compact": True},
+        json=atafdata,
+    )
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert [line["total"] for line in lines[1:]] == [association["total"] for association in expected]
+    assert all(len(line["counts"]) == line["shape"][0] * line["shape"][1] for line in lines[1:])
+
+    def fail(*args, **kwargs):
+        raise ValueError("counting failed")
+
+    monkeypatch.setattr(sql, "select_associations", fail)
+    resp = testclient.post(
+        f"/{table}/cohort/{cohort_id}/associations_to_all_features",
+        params={"stream": True},
+        headers={"Accept": "text/tabular"},
+        json=atafdata,
+    )
+    assert resp.status_code == 200
+    assert "counting failed" in resp.text
+
+
+@pytest.mark.parametrize("accept,expected", [
+    (None, False),
+    ("*/*", False),
+    ("application/json", False),
+    ("application/x-ndjson", True),
+    ("application/json, Application/X-NDJSON;q=0.5", True),
+    ("application/x-ndjson;q=0", False),
+])
+def test_accepts(accept, expected):
+    """Test that Accept headers are parsed for NDJSON."""
+    assert format_.accepts(accept, format_.NDJSON) == expected
+
+
+def test_generate_on_own_connection():
+    """Test that associations can be generated after the connection is closed."""
+    conn = connect(data, """
+        cohort_id,size,features,table,year
+        COHORT:1,13,"{}",patient,2010
+    """)
+    args = (
+        conn, table, None, "COHORT:1",
+        to_qualifiers({"AsthmaDx": {"operator": "=", "value": 1}}),
+        1,
+    )
+    expected = sql.select_associations_to_all_features(*args)
+    associations = sql.iter_associations_to_all_features(*args, own_connection=True)
+    conn.connection.close()
+    assert json.dumps(list(associations)) == json.dumps(expected)
@@ -0,0 +1,28 @@
+"""Test the Biolink hierarchy index."""
+from icees_api.features import biolink
+
+
+def test_index_matches_bmt(monkeypatch, tmp_path):
+    """Test that the compiled index gives the closures BMT does."""
+    path = tmp_path / "biolink_index.json"
+    monkeypatch.setattr(biolink, "INDEX_PATH", str(path))
+    monkeypatch.setattr("sys.argv", ["biolink"])
+    biolink.main()
+
+    monkeypatch.setattr(biolink, "index", None)
+    index = biolink.get_index()
+    assert "biolink:ChemicalEntity" in biolink.get_subcategories("biolink:NamedThing")
+    assert biolink.get_subcategories("biolink:Drug") == biolink.subcategories("biolink:Drug")
+    assert "biolink:correlated_with" in biolink.get_subpredicates("biolink:related_to")
+    assert biolink.get_subpredicates("biolink:affects") == biolink.subpredicates("biolink:affects")
+    assert "biolink:Drug" in index["categories"]
+
+
+def test_missing_index_falls_back_to_bmt(monkeypatch, tmp_path):
+    """Test that terms missing from the index are computed, without extending it."""
+    monkeypatch.setattr(biolink, "INDEX_PATH", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(biolink, "index", None)
+    assert biolink.get_subcategories("biolink:Drug") == biolink.subcategories("biolink:Drug")
+    assert biolink.get_subcategories("biolink:NotAClass") == ["biolink:NotAClass"]
+    assert biolink.get_index()["categories"] == {}
+    assert biolink.fallback_subcategories.cache_info().maxsize == biolink.FALLBACK_CACHE_SIZE
@@ -0,0 +1,144 @@
+"""Test the result cache."""
+import time
+
+import redis
+
+from icees_api.features import cache
+
+
+def disk_backend(monkeypatch, tmp_path):
+    """Cache on disk, in a fresh file."""
+    monkeypatch.setattr(cache, "backend", cache.SQLiteBackend(str(tmp_path / "cache.db")))
+    monkeypatch.setattr(cache, "local", cache.LRUCache(2 ** 20))
+
+
+def test_key():
+    """Test that keys are scoped to the cohort and dataset version."""
+    asthma = {"AsthmaDx": {"operator": "=", "value": 1}}
+    key = cache.key("count_unique", "patient", None, asthma, "AgeStudyStart")
+    assert key.startswith("icees:v1:count_unique:")
+    assert key == cache.key("count_unique", "patient", None, [{
+        "feature_name": "AsthmaDx",
+        "feature_qualifier": {"operator": "in", "values": [1]},
+    }], "AgeStudyStart")
+    assert key != cache.key("count_unique", "patient", None, {}, "AgeStudyStart")
+    assert key != cache.key("count_unique", "visit", None, asthma, "AgeStudyStart")
+
+
+def test_key_is_versioned(monkeypatch):
+    """Test that a new dataset version invalidates keys."""
+    key = cache.key("count_unique", "patient", None, {}, "AgeStudyStart")
+    monkeypatch.setattr(cache, "dataset_version", "other")
+    assert key != cache.key("count_unique", "patient", None, {}, "AgeStudyStart")
+
+
+def test_cached_expires(monkeypatch, tmp_path):
+    """Test that cached results are stored with a TTL."""
+    disk_backend(monkeypatch, tmp_path)
+    calls = []
+
+    @cache.cached(key=lambda x: cache.key("test", "patient", None, {}, x))
+    def double(x):
+        calls.append(x)
+        return 2 * x
+
+    assert double(21) == 42
+    assert double(21) == 42
+    assert calls == [21]
+    assert 0 < cache.backend.ttl(cache.key("test", "patient", None, {}, 21)) <= cache.CACHE_TTL
+
+
+def test_lru_is_bounded_by_bytes():
+    """Test that the local tier evicts least-recently-used values."""
+    lru = cache.LRUCache(max_bytes=30)
+    lru.put("a", [1], 10)
+    lru.put("b", [2], 10)
+    assert lru.get("a") == [1]
+    lru.put("c", [3], 10)
+    assert lru.get("b") is None
+    assert lru.get("a") == [1]
+    assert lru.get("c") == [3]
+    assert lru.n_bytes == 22
+    lru.put("d", list(range(100)), 100)
+    assert lru.get("d") is None
+
+
+def test_local_tier(monkeypatch, tmp_path):
+    """Test that hot keys are served from the local tier."""
+    disk_backend(monkeypatch, tmp_path)
+    key = cache.key("test", "patient", None, {}, "local")
+    cache.store(key, [1, 2])
+    cache.local.clear()
+    counters = cache.statistics()
+    assert cache.load(key) == [1, 2]
+    assert cache.load(key) == [1, 2]
+    assert cache.counters["shared"]["hits"] == counters["shared"]["hits"] + 1
+    assert cache.counters["local"]["hits"] == counters["local"]["hits"] + 1
+
+    cache.invalidate(key)
+    assert cache.load(key) is None
+
+
+def test_local_tier_expires_with_backend(monkeypatch, tmp_path):
+    """Test that values loaded from the backend expire locally when they do there."""
+    disk_backend(monkeypatch, tmp_path)
+    key = cache.key("test", "patient", None, {}, "expiring")
+    cache.backend.set(key, b"[1]", ttl=60)
+    assert cache.load(key) == [1]
+    _, _, expires = cache.local.entries[key]
+    assert expires <= time.time() + 60
+
+
+def test_disk_backend_expires(tmp_path):
+    """Test that the disk backend drops expired values."""
+    backend = cache.SQLiteBackend(str(tmp_path / "cache.db"))
+    backend.set("a", b"[1]", ttl=60)
+    backend.set("b", b"[2]", ttl=-1)
+    backend.set("c", b"[3]")
+    assert backend.get("a") == b"[1]"
+    assert 0 < backend.ttl("a") <= 60
+    assert backend.get("b") is None
+    assert backend.get("c") == b"[3]"
+    assert backend.ttl("c") is None
+    backend.delete("c")
+    assert backend.get("c") is None
+
+
+def test_unreachable_backend_degrades(monkeypatch):
+    """Test that an unreachable redis caches nothing instead of failing."""
+    backend = cache.RedisBackend("localhost", port=1)
+    monkeypatch.setattr(cache, "backend", backend)
+    monkeypatch.setattr(cache, "local", cache.LRUCache(0))
+    calls = []
+
+    @cache.cached(key=lambda x: cache.key("test", "patient", None, {}, x))
+    def double(x):
+        calls.append(x)
+        return 2 * x
+
+    assert double(21) == 42
+    assert double(21) == 42
+    assert calls == [21, 21]
+    assert not backend.available
+    assert cache.statistics()["backend"] == {"name": "redis", "available": False}
+
+
+class RefusingRedis():
+    """Redis client that replies with errors."""
+
+    def get(self, key_):
+        raise redis.exceptions.ResponseError("OOM command not allowed")
+
+    def config_set(self, name, value):
+        raise redis.exceptions.ResponseError("unknown command 'CONFIG'")
+
+
+def test_redis_error_replies_degrade(monkeypatch):
+    """Test that redis error replies skip the backend and do not fail configuration."""
+    monkeypatch.setattr(cache, "REDIS_MAXMEMORY", "1mb")
+    backend = cache.RedisBackend("localhost", port=1)
+    backend.client = RefusingRedis()
+    backend.configure()
+    assert backend.available
+    assert backend.get("a") is None
+    assert not backend.available
@@ -0,0 +1,75 @@
+"""Test canonical cohort definitions."""
+import pytest
+
+from icees_api.features.canonical import canonical_features, canonical_json
+
+
+def feature(name, qualifier, **kwargs):
+    """Build cohort feature."""
+    return {"feature_name": name, "feature_qualifier": qualifier, **kwargs}
+
+
+@pytest.mark.parametrize("cohort_features,expected", [
+    (
+        {"AsthmaDx": {"operator": "in", "values": [1, 0, 1]}},
+        [feature("AsthmaDx", {"operator": "in", "values": [0, 1]}, year=2010)],
+    ),
+    (
+        [feature("AsthmaDx", {"operator": "in", "values": [1]})],
+        [feature("AsthmaDx", {"operator": "=", "value": 1}, year=2010)],
+    ),
+    (
+        [
+            feature("AvgDailyPM2.5Exposure", {"operator": ">=", "value": 2}),
+            feature("AvgDailyPM2.5Exposure", {"operator": ">", "value": 1}),
+            feature("AvgDailyPM2.5Exposure", {"operator": "<=", "value": 4}),
+        ],
+        [feature(
+            "AvgDailyPM2.5Exposure",
+            {"operator": "between", "value_a": 2, "value_b": 4},
+            year=2010,
+        )],
+    ),
+    (
+        [
+            feature("AvgDailyPM2.5Exposure", {"operator": "in", "values": [1, 2, 5]}),
+            feature("AvgDailyPM2.5Exposure", {"operator": "<", "value": 5}),
+            feature("AvgDailyPM2.5Exposure", {"operator": "<>", "value": 1}),
+        ],
+        [feature("AvgDailyPM2.5Exposure", {"operator": "=", "value": 2}, year=2010)],
+    ),
+    (
+        [
+            feature("AgeStudyStart", {"operator": ">", "value": "3-17"}),
+            feature("AgeStudyStart", {"operator": ">", "value": "0-2"}),
+        ],
+        [
+            feature("AgeStudyStart", {"operator": ">", "value": "0-2"}, year=2010),
+            feature("AgeStudyStart", {"operator": ">", "value": "3-17"}, year=2010),
+        ],
+    ),
+    (
+        [
+            feature("AsthmaDx", {"operator": "=", "value": 1}, year=2011),
+            feature("AsthmaDx", {"operator": "=", "value": 0}),
+        ],
+        [
+            feature("AsthmaDx", {"operator": "=", "value": 0}, year=2010),
+            feature("AsthmaDx", {"operator": "=", "value": 1}, year=2011),
+        ],
+    ),
+])
+def test_canonical_features(cohort_features, expected):
+    """Test canonical forms."""
+    assert canonical_features(2010, cohort_features) == expected
+
+
+def test_canonical_json_is_order_independent():
+    """Test that equivalent definitions share their canonical JSON."""
+    assert canonical_json(None, {
+        "AsthmaDx": {"operator": "=", "value": 1},
+        "AgeStudyStart": {"operator": "in", "values": ["3-17", "0-2"]},
+    }) == canonical_json(None, [
+        feature("AgeStudyStart", {"operator": "in", "values": ["0-2", "3-17"]}, year=None),
+        feature("AsthmaDx", {"operator": "in", "values": [1]}),
+    ])
@@ -0,0 +1,233 @@
+"""Test cohort storage."""
+import asyncio
+import json
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.automap import automap_base
+
+from icees_api.dependencies import ConnectionWithTables
+from icees_api.features import columnar, sql
+
+from ..util import fill_db
+
+data = """
+    PatientId,year,AgeStudyStart,Albuterol,AvgDailyPM2.5Exposure,EstResidentialDensity,AsthmaDx
+    varchar(255),int,varchar(255),varchar(255),int,int,int
+    1,2010,0-2,0,1,0,1
+    2,2010,0-2,1,1,0,1
+    3,2010,0-2,>1,1,0,1
+    4,2010,0-2,0,2,0,1
+    5,2010,0-2,1,2,0,1
+    6,2010,0-2,>1,2,0,1
+    7,2010,0-2,0,3,0,1
+    8,2010,0-2,1,3,0,1
+    9,2010,0-2,>1,3,0,1
+    10,2010,0-2,0,4,0,1
+    11,2010,0-2,1,4,0,1
+    12,2010,0-2,>1,4,0,0
+    13,2010,3-17,>1,4,0,0
+"""
+
+
+def connect(data, cohort_data=""):
+    """Get connection to a fresh database."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, data, cohort_data))
+    return reflect(conn)
+
+
+def reflect(conn):
+    """Wrap connection with freshly-reflected tables."""
+    if isinstance(conn, ConnectionWithTables):
+        conn = conn.connection
+    Base = automap_base()
+    Base.prepare(conn.engine, reflect=True)
+    return ConnectionWithTables(conn, Base.metadata.tables)
+
+
+def test_multi_year_cohort_size():
+    """Test that cohorts count every row of their members, on SQL and columnar paths."""
+    multi_year_data = data + "\n".join(
+        "    " + line.replace(",2010,", ",2011,")
+        for line in data.strip().splitlines()[2:]
+    ) + "\n"
+    cohort_features = {"AsthmaDx": {"operator": "=", "value": 1}}
+    conn = connect(multi_year_data)
+    _, size = sql.select_cohort(conn, "patient", None, cohort_features)
+    assert size == 22
+
+    columnar.load(conn, ["patient"])
+    try:
+        _, columnar_size = sql.select_cohort(
+            conn, "patient", None, cohort_features, "columnar",
+        )
+    finally:
+        columnar.tables.clear()
+    assert columnar_size == size
+
+
+def test_edit_cohort():
+    """Test that editing a cohort replaces it."""
+    conn = connect(data)
+    cohort_id, _ = sql.select_cohort(
+        conn, "patient", None,
+        {"AsthmaDx": {"operator": "=", "value": 1}},
+    )
+
+    conn = reflect(conn)
+    edited_id, size = sql.select_cohort(
+        conn, "patient", None,
+        {"AsthmaDx": {"operator": "<", "value": 2}},
+        cohort_id,
+    )
+    assert (edited_id, size) == (cohort_id, 13)
+    assert sql.get_cohort_dictionary(conn, "patient", None) == [{
+        "cohort_id": cohort_id,
+        "size": 13,
+        "features": {"AsthmaDx": {"operator": "<", "value": 2}},
+    }]
+
+
+def test_edit_cohort_of_another_table():
+    """Test that editing does not replace a cohort of another table."""
+    conn = connect(data, """
+        cohort_id,size,features,table,year
+        COHORT:1,12,"{}",visit,2010
+    """)
+    with pytest.raises(HTTPException) as excinfo:
+        sql.select_cohort(
+            conn, "patient", None,
+            {"AsthmaDx": {"operator": "=", "value": 1}},
+            "COHORT:1",
+        )
+    assert excinfo.value.status_code == 400
+    assert sql.get_features_by_id(conn, "visit", "COHORT:1") == ({}, 2010)
+
+
+def test_count_unique_within_cohort():
+    """Test that cohort features filter counts through bound parameters."""
+    conn = connect(data)
+    assert sql.count_unique(
+        conn, "patient",
+        [{
+            "feature_name": "AgeStudyStart",
+            "feature_qualifier": {"operator": "=", "value": "3-17"},
+        }],
+        "AgeStudyStart", "AgeStudyStart",
+    ) == [["3-17", "3-17", 1]]
+
+
+def test_count_unique_pairs():
+    """Test that batched pair counts match per-pair counts."""
+    conn = connect(data)
+    cohort_features = [{
+        "feature_name": "Albuterol",
+        "feature_qualifier": {"operator": "in", "values": ["0", ">1"]},
+    }]
+    pairs = [
+        ("AgeStudyStart", "AsthmaDx"),
+        ("AsthmaDx", "AgeStudyStart"),
+        ("AvgDailyPM2.5Exposure", "AvgDailyPM2.5Exposure"),
+    ]
+    counts = sql.count_unique_pairs(conn, "patient", cohort_features, pairs)
+    assert set(counts) == set(pairs)
+    for pair in pairs:
+        assert sorted(counts[pair]) == sorted(
+            sql.count_unique.__wrapped__(conn, "patient", cohort_features, *pair)
+        )
+
+
+def test_count_unique_union_all_limits_parameters(monkeypatch):
+    """Test that pairs are chunked so each query binds few enough parameters."""
+    monkeypatch.setattr(sql, "VARIABLE_LIMIT", 5)
+    conn = connect(data)
+    cohort_features = [{
+        "feature_name": "Albuterol",
+        "feature_qualifier": {"operator": "in", "values": ["0", ">1"]},
+    }]
+    names = ["AgeStudyStart", "AsthmaDx", "Albuterol"]
+    pairs = [(ka, kb) for ka in names for kb in names]
+    parameters = []
+    event.listen(
+        conn.engine, "before_cursor_execute",
+        lambda conn, cursor, statement, params, context, executemany: parameters.append(len(params)),
+    )
+    counts = sql.count_unique_union_all(conn, "patient", cohort_features, pairs)
+    assert max(parameters) <= 5
+    assert len(parameters) == 5
+    for pair in pairs:
+        assert sorted(counts[pair]) == sorted(
+            sql.count_unique.__wrapped__(conn, "patient", cohort_features, *pair)
+        )
+
+
+def test_schema_is_reflected_once():
+    """Test that tables are shared until refreshed after DDL."""
+    engine = create_engine("sqlite://")
+    conn = engine.connect()
+    asyncio.run(fill_db(conn, data, ""))
+    tables = ConnectionWithTables(conn).tables
+    assert ConnectionWithTables(conn).tables is tables
+    assert "digest" not in tables["cohort"].c
+
+    sql.select_cohort(
+        ConnectionWithTables(conn), "patient", None,
+        {"AsthmaDx": {"operator": "=", "value": 1}},
+    )
+    assert "digest" in ConnectionWithTables(conn).tables["cohort"].c
+
+
+def test_allocate_cohort_id():
+    """Test that cohort ids continue after existing ids and skip taken ones."""
+    conn = connect(data, """
+        cohort_id,size,features,table,year
+        COHORT:3,12,"{}",patient,2010
+        COHORT:5,12,"{}",patient,2010
+        custom,12,"{}",patient,2010
+    """)
+    assert sql.allocate_cohort_id(conn) == "COHORT:6"
+    conn.execute(
+        "INSERT INTO cohort (cohort_id, size, features, \"table\", year) "
+        "VALUES ('COHORT:7', 12, '{}', 'patient', 2010)"
+    )
+    assert sql.allocate_cohort_id(conn) == "COHORT:8"
+    assert sql.allocate_cohort_id(conn) == "COHORT:9"
+
+
+def test_cohort_digest_migration():
+    """Test that existing cohorts are backfilled and found by digest."""
+    features = {"AsthmaDx": {"operator": "=", "value": 1}}
+    features_json = json.dumps(features, sort_keys=True).replace("\"", "\\\"")
+    conn = connect(data, f"""
+        cohort_id,size,features,table,year
+        COHORT:10,11,"{features_json}",patient,2010
+        COHORT:2,11,"{features_json}",patient,2010
+    """)
+    sql.ensure_cohort_digest(conn)
+    digests = dict(conn.execute("SELECT cohort_id, digest FROM cohort").fetchall())
+    assert digests["COHORT:2"] == sql.cohort_digest("patient", 2010, features)
+    assert digests["COHORT:10"] is None
+
+    assert sql.get_ids_by_feature(conn, "patient", 2010, [{
+        "feature_name": "AsthmaDx",
+        "feature_qualifier": {"operator": "=", "value": 1},
+    }]) == ("COHORT:2", 11)
+
+
+def test_concurrent_cohort_digest_migration():
+    """Test that migrating with a schema that predates the digest is harmless."""
+    features = {"AsthmaDx": {"operator": "=", "value": 1}}
+    features_json = json.dumps(features, sort_keys=True).replace("\"", "\\\"")
+    conn = connect(data, f"""
+        cohort_id,size,features,table,year
+        COHORT:1,11,"{features_json}",patient,2010
+        COHORT:2,11,"{features_json}",patient,2010
+    """)
+    stale = ConnectionWithTables(conn.connection, dict(conn.tables))
+    sql.ensure_cohort_digest(conn)
+    sql.ensure_cohort_digest(stale)
+    digests = dict(conn.execute("SELECT cohort_id, digest FROM cohort").fetchall())
+    assert digests["COHORT:1"] == sql.cohort_digest("patient", 2010, features)
+    assert digests["COHORT:2"] is None
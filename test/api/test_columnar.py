@@ -0,0 +1,372 @@
+"""Test the in-memory columnar engine, snapshots and the contingency cube."""
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.sql import select, func
+
+from icees_api.app import APP
+from icees_api.features import cache, columnar, cube, snapshot, sql
+from icees_api.features.sql import (
+    feature_count_all_values, generate_tables_from_features, get_feature_levels,
+    normalize_features, select_cohort_profile, select_feature_count_all_values,
+)
+
+from ..util import load_data, escape_quotes, fill_db
+
+testclient = TestClient(APP)
+table = "patient"
+data = """
+    PatientId,year,AgeStudyStart,Albuterol,AvgDailyPM2.5Exposure,EstResidentialDensity,AsthmaDx
+    varchar(255),int,varchar(255),varchar(255),int,int,int
+    1,2010,0-2,0,1,0,1
+    2,2010,3-17,1,1,0,1
+    3,2010,18-34,>1,1,0,1
+    4,2010,35-50,0,2,0,1
+    5,2010,51-69,1,2,0,1
+    6,2010,70-89,>1,2,0,1
+    7,2010,0-2,0,3,0,0
+    8,2010,0-2,1,3,0,0
+    9,2010,0-2,>1,3,0,0
+    10,2010,0-2,0,4,0,1
+    11,2010,0-2,1,4,0,1
+    12,2010,0-2,,4,0,1
+"""
+cohort_features = [
+    {
+        "feature_name": "AsthmaDx",
+        "feature_qualifier": {
+            "operator": "=",
+            "value": 1
+        }
+    }
+]
+cohort_data = """
+    cohort_id,size,features,table,year
+    COHORT:1,12,"{}",patient,2010
+    COHORT:2,9,"{0}",patient,2010
+""".replace("{0}", escape_quotes(json.dumps(cohort_features, sort_keys=True)))
+
+
+@pytest.fixture
+def columnar_patient():
+    """Load the patient table into the columnar engine."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, data, ""))
+    columnar.load(conn, [table])
+    yield columnar.get_table(table)
+    columnar.tables.clear()
+    conn.close()
+
+
+def test_contingency(columnar_patient):
+    """Test that levels follow value_sets.yml and NULL gets its own code."""
+    albuterol = columnar_patient.column("Albuterol")
+    assert albuterol.levels == ["0", "1", ">1", None]
+    exposure = columnar_patient.column("AvgDailyPM2.5Exposure")
+    assert exposure.levels == [1, 2, 3, 4, 5]
+    counts = columnar_patient.contingency("Albuterol", "AvgDailyPM2.5Exposure")
+    assert counts.shape == (4, 5)
+    assert counts.sum() == 12
+    assert counts[3, 3] == 1
+
+
+@pytest.mark.parametrize("cohort_id,expected,total", [
+    ("COHORT:1", [[1, 2, 2], [6, 0, 0]], 12),
+    ("COHORT:2", [[1, 2, 2], [3, 0, 0]], 9),
+])
+@load_data(APP, data, cohort_data)
+def test_feature_association2(cohort_id, expected, total, columnar_patient):
+    """Test feature association computed by the columnar engine."""
+    atafdata = {
+        "feature_a": {
+            "feature_name": "AgeStudyStart",
+            "feature_qualifiers": [
+                {"operator": "=", "value": "0-2"},
+                {"operator": "in", "values": ["3-17", "18-34"]},
+                {"operator": ">", "value": "35-50"},
+            ]
+        },
+        "feature_b": {
+            "feature_name": "AvgDailyPM2.5Exposure",
+            "feature_qualifiers": [
+                {"operator": "<", "value": 3},
+                {"operator": ">=", "value": 3},
+            ]
+        }
+    }
+    resp = testclient.post(
+        f"/{table}/cohort/{cohort_id}/feature_association2",
+        json=atafdata,
+    )
+    return_value = resp.json()["return value"]
+    assert [
+        [cell["frequency"] for cell in row]
+        for row in return_value["feature_matrix"]
+    ] == expected
+    assert return_value["total"] == total
+
+
+@load_data(APP, data, cohort_data)
+def test_post_cohort(columnar_patient):
+    """Test cohort size computed by the bitmap index."""
+    resp = testclient.post(
+        f"/{table}/cohort",
+        json={"AgeStudyStart": {"operator": "<>", "value": "51-69"}},
+    )
+    assert resp.json()["return value"]["size"] == 11
+
+
+multiyear_data = """
+    PatientId,year,AgeStudyStart,Albuterol,AvgDailyPM2.5Exposure,EstResidentialDensity,AsthmaDx
+    varchar(255),int,varchar(255),varchar(255),int,int,int
+    1,2010,0-2,0,1,0,1
+    1,2011,3-17,1,1,0,0
+    2,2010,0-2,>1,2,0,1
+    2,2011,0-2,0,2,0,1
+    3,2010,3-17,1,3,0,0
+    3,2011,3-17,>1,3,0,1
+    4,2011,0-2,0,4,0,1
+    5,2010,0-2,,5,0,1
+"""
+
+
+@pytest.mark.parametrize("year", [None, 2010, 2011, 2012])
+@pytest.mark.parametrize("cohort_features", [
+    [],
+    [{"feature_name": "AsthmaDx", "feature_qualifier": {"operator": "=", "value": 1}}],
+    [
+        {"feature_name": "AsthmaDx", "feature_qualifier": {"operator": "=", "value": 1}},
+        {"feature_name": "Albuterol", "feature_qualifier": {"operator": "<>", "value": "0"}},
+    ],
+    [
+        {"feature_name": "AgeStudyStart", "feature_qualifier": {"operator": "=", "value": "0-2"}, "year": 2010},
+        {"feature_name": "AsthmaDx", "feature_qualifier": {"operator": "=", "value": 1}, "year": 2011},
+    ],
+    [
+        {"feature_name": "AgeStudyStart", "feature_qualifier": {"operator": "in", "values": ["0-2", "3-17"]}, "year": 2010},
+        {"feature_name": "AvgDailyPM2.5Exposure", "feature_qualifier": {"operator": "between", "value_a": 2, "value_b": 4}},
+    ],
+])
+def test_cohort_size_matches_sql(cohort_features, year):
+    """Test that the bitmap index agrees with the SQL cohort join."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, multiyear_data, ""))
+    columnar.load(conn, [table])
+    try:
+        cohort_features_norm = normalize_features(year, cohort_features)
+        cohort_table, _ = generate_tables_from_features(
+            table, cohort_features_norm, year, [],
+        )
+        expected = conn.execute(
+            select([func.count()]).select_from(cohort_table)
+        ).scalar()
+        index = columnar.get_table(table).index
+        assert index.cohort_size(cohort_features_norm, year) == expected
+        assert index.cohort_id_counts(cohort_features_norm, year).sum() == expected
+    finally:
+        columnar.tables.clear()
+        conn.close()
+
+
+@pytest.mark.parametrize("qualifier", [
+    {"operator": "<>", "value": "0"},
+    {"operator": "<>", "value": ">1"},
+    {"operator": "=", "value": "1"},
+])
+def test_null_qualifier_matches_sql(qualifier):
+    """Test that NULL values are filtered out as in SQL, including by "<>"."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, data, ""))
+    columnar.load(conn, [table])
+    try:
+        cohort_features = normalize_features(None, [
+            {"feature_name": "Albuterol", "feature_qualifier": qualifier},
+        ])
+        cohort_table, _ = generate_tables_from_features(
+            table, cohort_features, None, [],
+        )
+        expected = conn.execute(
+            select([func.count()]).select_from(cohort_table)
+        ).scalar()
+        albuterol = columnar.get_table(table).column("Albuterol")
+        assert None in albuterol.levels
+        assert albuterol.mask(qualifier).sum() == expected
+        assert columnar.get_table(table).index.cohort_size(cohort_features, None) == expected
+    finally:
+        columnar.tables.clear()
+        conn.close()
+
+
+@pytest.mark.parametrize("cohort_year", [None, 2011])
+@pytest.mark.parametrize("cohort_features", [
+    [],
+    [{"feature_name": "AsthmaDx", "feature_qualifier": {"operator": "=", "value": 1}}],
+    [
+        {"feature_name": "AgeStudyStart", "feature_qualifier": {"operator": "=", "value": "0-2"}, "year": 2010},
+        {"feature_name": "AsthmaDx", "feature_qualifier": {"operator": "=", "value": 1}, "year": 2011},
+    ],
+])
+def test_profile_matches_sql(cohort_features, cohort_year):
+    """Test that one-pass cohort profiles agree with per-feature counts."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, multiyear_data, ""))
+    names = ["AgeStudyStart", "Albuterol", "AsthmaDx"]
+    try:
+        profile = select_cohort_profile(
+            conn, table, None, cohort_features, cohort_year, names,
+        )
+        for name in names:
+            assert feature_count_all_values(
+                name, None, get_feature_levels(name), profile[name],
+            ) == select_feature_count_all_values(
+                conn, table, None, cohort_features, cohort_year,
+                name, get_feature_levels(name),
+            )
+        columnar.load(conn, [table])
+        assert select_cohort_profile(
+            conn, table, None, cohort_features, cohort_year, names,
+        ) == profile
+    finally:
+        columnar.tables.clear()
+        conn.close()
+
+
+def test_profile_in_chunks(monkeypatch):
+    """Test that profiles counted over several UNION ALL queries agree."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, multiyear_data, ""))
+    names = ["AgeStudyStart", "Albuterol", "AsthmaDx"]
+    try:
+        profile = select_cohort_profile(conn, table, None, [], None, names)
+        monkeypatch.setattr(sql, "UNION_LIMIT", 2)
+        assert select_cohort_profile(conn, table, None, [], None, names) == profile
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def patient_cube(columnar_patient, tmp_path, monkeypatch):
+    """Build a contingency cube of the patient table, and serve it."""
+    cube.write(tmp_path, *cube.build(columnar_patient))
+    monkeypatch.setattr(cube, "CUBE_PATH", str(tmp_path))
+    cube.cubes.clear()
+    yield cube.get_cube(table)
+    cube.cubes.clear()
+
+
+def test_cube(columnar_patient, patient_cube):
+    """Test that cube counts agree with the columnar engine."""
+    names = [name for name in columnar_patient.columns if name != "year"]
+    for name_a in names:
+        for name_b in names:
+            assert (
+                patient_cube.contingency(name_a, name_b) ==
+                columnar_patient.contingency(name_a, name_b)
+            ).all()
+
+
+def test_stale_cube(columnar_patient, tmp_path, monkeypatch):
+    """Test that a cube of another dataset version is not used."""
+    cube.write(tmp_path, *cube.build(columnar_patient, version="2021-01"))
+    monkeypatch.setattr(cube, "CUBE_PATH", str(tmp_path))
+    monkeypatch.setattr(cube, "cubes", {})
+    monkeypatch.setattr(cache, "dataset_version", "2021-02")
+    assert cube.get_cube(table) is None
+    monkeypatch.setattr(cache, "dataset_version", "2021-01")
+    assert cube.get_cube(table) is not None
+
+
+@load_data(APP, data, cohort_data)
+def test_feature_association2_from_cube(patient_cube):
+    """Test feature association served from the cube."""
+    columnar.tables.clear()
+    atafdata = {
+        "feature_a": {
+            "feature_name": "AvgDailyPM2.5Exposure",
+            "feature_qualifiers": [
+                {"operator": "<", "value": 3},
+                {"operator": ">=", "value": 3},
+            ]
+        },
+        "feature_b": {
+            "feature_name": "AgeStudyStart",
+            "feature_qualifiers": [
+                {"operator": "=", "value": "0-2"},
+                {"operator": "<>", "value": "0-2"},
+            ]
+        }
+    }
+    resp = testclient.post(
+        f"/{table}/cohort/COHORT:1/feature_association2",
+        json=atafdata,
+    )
+    return_value = resp.json()["return value"]
+    assert [
+        [cell["frequency"] for cell in row]
+        for row in return_value["feature_matrix"]
+    ] == [[1, 6], [5, 0]]
+
+
+def test_snapshot(columnar_patient, tmp_path):
+    """Test that a snapshot round-trips through memory-mapped files."""
+    manifest = snapshot.write(tmp_path / "a", [columnar_patient])
+    assert manifest["version"] == snapshot.write(tmp_path / "b", [columnar_patient])["version"]
+    assert manifest["tables"][table]["columns"]["Albuterol"]["dtype"] == "uint8"
+
+    snapshot_patient = snapshot.read(tmp_path / "a")[table]
+    assert isinstance(snapshot_patient.column("Albuterol").codes, np.memmap)
+    assert list(snapshot_patient.ids) == list(columnar_patient.ids)
+    for name, column in columnar_patient.columns.items():
+        assert snapshot_patient.column(name).levels == column.levels
+        assert (snapshot_patient.contingency(name) == columnar_patient.contingency(name)).all()
+
+
+def test_snapshot_is_indexed_on_first_use(columnar_patient, tmp_path):
+    """Test that a registered snapshot table builds its bitmap index lazily."""
+    snapshot.write(tmp_path, [columnar_patient])
+    columnar.register(snapshot.read(tmp_path)[table])
+    snapshot_patient = columnar.get_table(table)
+    assert snapshot_patient._index is None
+    cohort_features_norm = normalize_features(2010, cohort_features)
+    assert snapshot_patient.index.cohort_size(cohort_features_norm, 2010) == 9
+    assert snapshot_patient._index is snapshot_patient.index
+
+
+def test_index_mask(columnar_patient):
+    """Test that the bitmap index gives the mask of the columns, in table order."""
+    features = [
+        {"feature_name": "Albuterol", "feature_qualifier": {"operator": "in", "values": ["0", ">1"]}},
+        {"feature_name": "AsthmaDx", "feature_qualifier": {"operator": "=", "value": 1}},
+    ]
+    expected = None
+    for feature in features:
+        feature_mask = columnar_patient.column(feature["feature_name"]).mask(feature["feature_qualifier"])
+        expected = feature_mask if expected is None else expected & feature_mask
+    assert (columnar_patient.index.mask(features) == expected).all()
+    assert list(columnar_patient.ids[expected]) == ["1", "3", "4", "6", "10"]
+
+
+def test_load_in_chunks(columnar_patient, monkeypatch):
+    """Test that tables loaded a few rows at a time are encoded the same."""
+    conn = create_engine("sqlite://").connect()
+    asyncio.run(fill_db(conn, data, ""))
+    monkeypatch.setattr(columnar, "FETCH_SIZE", 5)
+    try:
+        chunked = columnar.load_table(conn, table)
+    finally:
+        conn.close()
+    assert list(chunked.ids) == list(columnar_patient.ids)
+    for name, column in columnar_patient.columns.items():
+        assert chunked.column(name).levels == column.levels
+        assert chunked.column(name).codes.dtype == column.codes.dtype
+        assert (chunked.column(name).codes == column.codes).all()
+
+
+def test_fill_grows():
+    """Test that rows beyond the preallocated count are kept."""
+    codes = columnar.fill(np.zeros(2, dtype=np.uint32), [1, 2, 3], 1)
+    assert list(codes) == [0, 1, 2, 3]
@@ -0,0 +1,95 @@
+"""Test the dataset version."""
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+
+from icees_api.app import APP
+from icees_api.features import cache, columnar, dataset_version
+
+from .test_cohort import connect, data
+
+testclient = TestClient(APP)
+
+
+def test_fingerprint_tracks_reloads():
+    """Test that the fingerprint changes when rows are reloaded."""
+    conn = connect(data)
+    version = dataset_version.read(conn)
+    assert version == dataset_version.fingerprint(conn)
+    conn.execute("DELETE FROM patient WHERE PatientId = '13'")
+    assert dataset_version.read(conn) != version
+
+
+def test_stamp_overrides_fingerprint():
+    """Test that the latest stamped version is used."""
+    conn = connect(data)
+    dataset_version.stamp(conn, "2021-01")
+    dataset_version.stamp(conn, "2021-02")
+    assert dataset_version.read(conn) == "2021-02"
+    assert dataset_version.stamp(conn).endswith(dataset_version.fingerprint(conn))
+
+
+def test_update_versions_cache(monkeypatch):
+    """Test that a new database version changes cache keys and clears the local tier."""
+    monkeypatch.setattr(cache, "dataset_version", "unversioned")
+    monkeypatch.setattr(cache, "local", cache.LRUCache(2 ** 20))
+    conn = connect(data)
+    key = cache.key("test", "patient", None, {})
+    cache.local.put(key, [1], 1)
+
+    assert dataset_version.update(conn)
+    assert cache.dataset_version == dataset_version.fingerprint(conn)
+    assert cache.key("test", "patient", None, {}) != key
+    assert cache.local.get(key) is None
+    assert not dataset_version.update(conn)
+
+
+def test_update_reloads_columnar_tables(monkeypatch):
+    """Test that the columnar engine serves the new data of a new version."""
+    monkeypatch.setattr(cache, "dataset_version", "unversioned")
+    monkeypatch.setattr(cache, "local", cache.LRUCache(2 ** 20))
+    monkeypatch.setattr(columnar, "tables", {})
+    conn = connect(data)
+    columnar.load(conn, ["patient"])
+    assert len(columnar.get_table("patient")) == 13
+    conn.execute("DELETE FROM patient WHERE PatientId = '13'")
+
+    assert dataset_version.update(conn)
+    assert len(columnar.get_table("patient")) == 12
+
+
+def test_stamp_is_read_with_stale_schema():
+    """Test that a stamp is preferred even if written after the schema was reflected."""
+    conn = connect(data)
+    stale = dataset_version.ConnectionWithTables(conn.connection, dict(conn.tables))
+    dataset_version.stamp(conn, "2021-01")
+    assert dataset_version.read(stale) == "2021-01"
+
+
+def test_watch_updates_version(monkeypatch):
+    """Test that the version is updated in the background."""
+    monkeypatch.setattr(cache, "dataset_version", "unversioned")
+    monkeypatch.setattr(cache, "local", cache.LRUCache(2 ** 20))
+    conn = connect(data)
+
+    @contextmanager
+    def connection():
+        yield conn.connection
+
+    updated = []
+
+    def update(conn):
+        updated.append(dataset_version.read(conn))
+        dataset_version.stopped.set()
+
+    monkeypatch.setattr(dataset_version, "DBConnection", connection)
+    monkeypatch.setattr(dataset_version, "update", update)
+    dataset_version.stopped.clear()
+    dataset_version.watch(0)
+    assert updated == [dataset_version.fingerprint(conn)]
+
+
+def test_version_header():
+    """Test that responses carry the dataset version."""
+    response = testclient.get("/tos")
+    assert response.headers["X-ICEES-Dataset-Version"] == str(cache.dataset_version)
@@ -176,3 +176,83 @@ def test_feature_association2_explicit_check_coverage_is_full():
     resp_json = resp.json()
     assert "return value" in resp_json
     do_verify_feature_matrix_response(resp_json["return value"])
+
+
+@load_data(
+    APP,
+    """
+        PatientId,year,AgeStudyStart,Albuterol,AvgDailyPM2.5Exposure,EstResidentialDensity,AsthmaDx
+        varchar(255),int,varchar(255),varchar(255),int,int,int
+        1,2010,0-2,0,1,0,1
+        2,2010,3-17,1,1,0,1
+        3,2010,18-34,>1,1,0,1
+        4,2010,35-50,0,2,0,1
+        5,2010,51-69,1,2,0,1
+        6,2010,70-89,>1,2,0,1
+        7,2010,0-2,0,3,0,1
+        8,2010,0-2,1,3,0,1
+        9,2010,0-2,>1,3,0,1
+        10,2010,0-2,0,4,0,1
+        11,2010,0-2,1,4,0,1
+        12,2010,0-2,,,0,1
+    """,
+    """
+        cohort_id,size,features,table,year
+        COHORT:1,12,"{}",patient,2010
+    """
+)
+def test_feature_association2_between():
+    """Test that between qualifiers are counted and NULL satisfies none."""
+    cohort_id = "COHORT:1"
+    atafdata = {
+        "feature_a": {
+            "feature_name": "AvgDailyPM2.5Exposure",
+            "feature_qualifiers": [
+                {"operator": "between", "value_a": 1, "value_b": 2},
+                {"operator": ">", "value": 2},
+            ]
+        },
+        "feature_b": {
+            "feature_name": "Albuterol",
+            "feature_qualifiers": [
+                {"operator": "=", "value": "0"},
+                {"operator": "<>", "value": "0"},
+            ]
+        },
+    }
+    resp = testclient.post(
+        f"/{table}/cohort/{cohort_id}/feature_association2",
+        json=atafdata,
+    )
+    resp_json = resp.json()
+    assert "return value" in resp_json
+    feature_matrix = [
+        [cell["frequency"] for cell in row]
+        for row in resp_json["return value"]["feature_matrix"]
+    ]
+    assert feature_matrix == [[2, 2], [4, 3]]
+    assert resp_json["return value"]["total"] == 12
+
+    resp = testclient.post(
+        f"/{table}/cohort/{cohort_id}/feature_association2",
+        params={"compact": True},
+        json=atafdata,
+    )
+    verbose = resp_json["return value"]
+    compact = resp.json()["return value"]
+    assert "feature_matrix" not in compact
+    assert compact["shape"] == [2, 2]
+    assert compact["counts"] == [2, 2, 4, 3]
+    assert compact["row_totals"] == [row["frequency"] for row in verbose["rows"]]
+    assert compact["column_totals"] == [column["frequency"] for column in verbose["columns"]]
+    assert compact["p_value"] == verbose["p_value"]
+    assert compact["total"] == 12
+
+    resp = testclient.post(
+        f"/{table}/cohort/{cohort_id}/feature_association2",
+        params={"compact": True},
+        headers={"Accept": "text/tabular"},
+        json=atafdata,
+    )
+    assert resp.status_code == 200
+    assert "p_value" in resp.text
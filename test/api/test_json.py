@@ -0,0 +1,41 @@
+"""Test NaN-aware JSON encoding."""
+import json
+
+import numpy as np
+import pytest
+
+from icees_api.app import NaNResponse
+from icees_api.features import json_
+
+content = {
+    "p_value": float("nan"),
+    "feature_matrix": [[1, float("inf")], [np.int64(2), np.float64("nan")]],
+    "counts": np.array([[1, 2], [3, 4]])[:, ::-1],
+    "margins": np.array([0.5, np.nan]),
+    "name": "Müller",
+    1: np.bool_(True),
+    "last": float("nan"),
+}
+expected = {
+    "p_value": None,
+    "feature_matrix": [[1, None], [2, None]],
+    "counts": [[2, 1], [4, 3]],
+    "margins": [0.5, None],
+    "name": "Müller",
+    "1": True,
+    "last": None,
+}
+
+
+@pytest.mark.parametrize("orjson", [json_.orjson, None])
+def test_dumps(monkeypatch, orjson):
+    """Test that NaNs become null anywhere, and NumPy objects are encoded."""
+    if json_.orjson is None and orjson is not None:
+        pytest.skip("orjson is not installed")
+    monkeypatch.setattr(json_, "orjson", orjson)
+    assert json.loads(json_.dumps(content)) == expected
+
+
+def test_nan_response():
+    """Test that responses are valid JSON."""
+    assert json.loads(NaNResponse(content).body) == expected
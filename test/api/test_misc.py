@@ -255,3 +255,18 @@ def test_openapi():
     response = testclient.get("/openapi.json")
 
     assert response.status_code == 200
+
+
+@load_data(
+    APP,
+    """
+        PatientId,year,AgeStudyStart,Albuterol,AvgDailyPM2.5Exposure,EstResidentialDensity,AsthmaDx
+        varchar(255),int,varchar(255),varchar(255),int,int,int
+        1,2010,0-2,0,1,0,1
+    """,
+)
+def test_refresh_schema():
+    response = testclient.post("/admin/refresh_schema")
+
+    assert response.status_code == 200
+    assert response.json()["return value"] == ["cohort", "patient"]
@@ -0,0 +1,46 @@
+"""Test static responses."""
+import os
+
+from fastapi.testclient import TestClient
+
+from icees_api.app import APP
+from icees_api.features import static
+
+testclient = TestClient(APP)
+
+
+def test_meta_knowledge_graph():
+    """Test that the meta-knowledge graph is served with an ETag."""
+    response = testclient.get("/meta_knowledge_graph")
+    assert response.status_code == 200
+    meta_kg = response.json()
+    assert set(meta_kg) == {"terms and conditions", "nodes", "edges"}
+    n_categories = len({edge["subject"] for edge in meta_kg["edges"]})
+    assert len(meta_kg["edges"]) == 2 * n_categories ** 2
+
+    etag = response.headers["ETag"]
+    response = testclient.get("/meta_knowledge_graph", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_rebuilt_when_files_change(tmp_path):
+    """Test that static responses are only rebuilt when their files change."""
+    path = tmp_path / "values.txt"
+    path.write_text("1")
+    registry = static.Registry()
+    builds = []
+
+    @registry.register("values", [str(path)])
+    def values():
+        builds.append(1)
+        return [int(path.read_text())]
+
+    registry.build_all()
+    assert registry.get("values").body == b"[1]"
+    assert len(builds) == 1
+
+    path.write_text("2")
+    os.utime(path, ns=(0, 0))
+    assert registry.get("values").value == [2]
+    assert len(builds) == 2
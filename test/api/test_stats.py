@@ -0,0 +1,35 @@
+"""Test batched association statistics."""
+import numpy as np
+import pytest
+from scipy.stats import chi2_contingency
+from statsmodels.stats.multitest import multipletests
+
+from icees_api.features import stats
+
+
+def test_chi2_batch():
+    """Test that batched statistics agree with chi2_contingency."""
+    rng = np.random.default_rng(0)
+    tables = [
+        *(rng.integers(1, 20, size=(2, 3)) for _ in range(3)),
+        *(rng.integers(1, 20, size=(4, 2)) for _ in range(2)),
+        np.array([[3, 4, 5]]),
+        np.zeros((0, 0)),
+    ]
+    chi_squared, p_values = stats.chi2_batch(tables)
+    for table, chi_squared_, p_value in zip(tables[:-1], chi_squared, p_values):
+        expected_chi_squared, expected_p_value, *_ = chi2_contingency(
+            table, correction=False,
+        )
+        assert chi_squared_ == pytest.approx(expected_chi_squared)
+        assert p_value == pytest.approx(expected_p_value)
+    assert (chi_squared[-1], p_values[-1]) == (None, None)
+
+
+def test_correct():
+    """Test that correction is applied once over the family."""
+    p_values = [0.01, None, 0.04, 0.2]
+    _, expected, _, _ = multipletests([0.01, 0.04, 0.2], 1, "bonferroni")
+    corrected = stats.correct(p_values, "bonferroni")
+    assert corrected[1] is None
+    assert [corrected[0], corrected[2], corrected[3]] == pytest.approx(list(expected))
@@ -0,0 +1,53 @@
+"""Test the cache warmup."""
+import json
+
+from icees_api.features import cache, sql, warmup
+
+from .test_cohort import connect, data
+
+
+def test_warmup(monkeypatch, tmp_path):
+    """Test that listed and popular cohorts are computed into the cache."""
+    monkeypatch.setattr(cache, "backend", cache.MemoryBackend())
+    monkeypatch.setattr(cache, "local", cache.LRUCache(2 ** 20))
+    conn = connect(data)
+    popular_id, _ = sql.get_ids_by_feature(
+        conn, "patient", None, {"AsthmaDx": {"operator": "=", "value": 1}},
+    )
+    path = f"/patient/cohort/{popular_id}/features"
+    with open(tmp_path / "server", "w") as stream:
+        for entry in [
+                {"event": "request", "full_path": path, "response_status": 200},
+                {"event": "request", "full_path": path, "response_status": 200},
+                {"event": "request", "full_path": "/patient/cohort/COHORT:99/features", "response_status": 200},
+                {"event": "request", "full_path": "/patient/cohort", "response_status": 200},
+        ]:
+            stream.write(json.dumps(entry) + "\n")
+        stream.write("not a request\n")
+    assert warmup.top_cohorts(1, tmp_path) == [("patient", popular_id)]
+
+    cohorts = [{
+        "table": "patient",
+        "cohort_features": {},
+        "feature_association2": [{
+            "feature_a": {"AgeStudyStart": [
+                {"operator": "=", "value": "0-2"},
+                {"operator": "=", "value": "3-17"},
+            ]},
+            "feature_b": {"AsthmaDx": [
+                {"operator": "=", "value": 0},
+                {"operator": "=", "value": 1},
+            ]},
+        }],
+        "associations_to_all_features": [
+            {"feature": {"AsthmaDx": {"operator": "=", "value": 1}}},
+        ],
+    }]
+    assert warmup.run(conn, cohorts, n_top=2, log_path=tmp_path) == 4
+
+    computed = []
+    monkeypatch.setattr(sql, "select_cohort_profile", lambda *args: computed.append(args))
+    for cohort_id in (popular_id, sql.get_ids_by_feature(conn, "patient", None, {})[0]):
+        cohort_features, cohort_year = sql.get_features_by_id(conn, "patient", cohort_id)
+        sql.get_cohort_features(conn, "patient", None, cohort_features, cohort_year)
+    assert computed == []
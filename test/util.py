@@ -9,6 +9,7 @@ from uuid import uuid4
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.pool import StaticPool
 
 from icees_api.dependencies import get_db, ConnectionWithTables
 
@@ -130,9 +131,11 @@ async def fill_db(conn: Connection, data: str, cohort_data: str):
 
 async def get_db_(data: str, cohort_data: str):
     """Get database connection."""
+    # every connection shares the in-memory database, like connections to a file
     engine = create_engine(
         f"sqlite://",
         connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
     )
     conn = engine.connect()
 